@@ -0,0 +1,79 @@
+"""Minimal offline stand-ins for the parts of ricecooker imscp uses.
+
+Installed by the benchmark suite when ricecooker isn't available (or with
+--stub-ricecooker), so make_topic_tree can be timed without ricecooker, its
+dependencies or any network access. Nodes just record what they were given
+and nothing is ever uploaded. Zips are built with imscp.ziputils, which
+writes the same bytes as ricecooker's create_predictable_zip.
+"""
+import os
+import sys
+import tempfile
+import types
+
+
+class Node(object):
+    kind = None
+
+    def __init__(self, source_id, title, license=None, files=None, **kwargs):
+        self.source_id = source_id
+        self.title = title
+        self.license = license
+        self.files = files or []
+        self.children = []
+        self.extra_fields = {}
+
+    def add_child(self, node):
+        self.children.append(node)
+
+
+class TopicNode(Node):
+    kind = 'topic'
+
+
+class HTML5AppNode(Node):
+    kind = 'html5'
+
+
+class HTMLZipFile(object):
+    def __init__(self, path, preset=None):
+        self.path = path
+        self.preset = preset
+
+
+def create_predictable_zip(path):
+    from imscp.ziputils import save_zip_bytes, predictable_zip_bytes
+
+    entries = []
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            with open(file_path, 'rb') as f:
+                entries.append((os.path.relpath(file_path, path), f.read()))
+    return save_zip_bytes(predictable_zip_bytes(entries), tempfile.gettempdir())
+
+
+def install():
+    """Register the stub modules in sys.modules."""
+    modules = {
+        'ricecooker': {},
+        'ricecooker.classes': {},
+        'ricecooker.classes.nodes': {
+            'TopicNode': TopicNode, 'HTML5AppNode': HTML5AppNode},
+        'ricecooker.classes.files': {'HTMLZipFile': HTMLZipFile},
+        'ricecooker.classes.licenses': {'get_license': lambda *args, **kwargs: None},
+        'ricecooker.utils': {},
+        'ricecooker.utils.zip': {'create_predictable_zip': create_predictable_zip},
+        'ricecooker.utils.browser': {'preview_in_browser': lambda *args: None},
+        'le_utils': {},
+        'le_utils.constants': {},
+        'le_utils.constants.format_presets': {'HTML5_DEPENDENCY_ZIP': 'html5_dependency'},
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+    for name in modules:
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, sys.modules[name])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""Benchmark each stage of the IMSCP pipeline on synthetic packages.
+
+Generates one package per scenario (see SCENARIOS), then records the wall
+time and peak memory (resident set size) of each stage: parsing the
+manifest, walk_items, collect_resources, extract_from_dir from a directory
+and from a ZipPackage, iter_items and make_topic_tree. Runs fully offline;
+if ricecooker isn't installed (or with --stub-ricecooker) a stub stands in
+for it so nothing is ever uploaded.
+
+    PYTHONPATH=src python benchmarks/run.py --save benchmarks/baseline.json
+    PYTHONPATH=src python benchmarks/run.py --baseline benchmarks/baseline.json
+
+When comparing, the exit status is 1 if any stage got slower than the
+baseline by more than --threshold.
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+
+
+SCENARIOS = {
+    'small': dict(depth=2, fanout=4),
+    'deep': dict(depth=8, fanout=2),
+    'wide': dict(depth=2, fanout=60),
+    'shared-deps': dict(depth=3, fanout=8, dependencies='shared', shared_files=200),
+    'dependency-chain': dict(depth=3, fanout=8, dependencies='chain', chain_length=50),
+    'dependency-cycle': dict(depth=3, fanout=6, dependencies='cycle', chain_length=10),
+    'metadata-heavy': dict(depth=3, fanout=8, metadata_density=1.0),
+    'many-files': dict(depth=2, fanout=6, files_per_resource=60, file_size=16 * 1024),
+    'bad-encoding': dict(depth=3, fanout=8, metadata_density=0.5, bad_encoding=True),
+    'shared-build': dict(depth=2, fanout=6, dependencies='shared', shared_files=100),
+}
+
+# Building HTML zips is much slower, so it only runs on a few scenarios.
+BUILD_SCENARIOS = ('small', 'many-files', 'shared-build')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+            help='Scenario to run (can be repeated). Defaults to all of them.')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='Times to run each stage; the fastest run is kept.')
+    parser.add_argument('--save', help='Write results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare results to this JSON file.')
+    parser.add_argument('--threshold', type=float, default=1.25,
+            help='Slowdown ratio over the baseline that counts as a regression.')
+    parser.add_argument('--stub-ricecooker', action='store_true',
+            help='Use the offline ricecooker stub even if ricecooker is installed.')
+    parser.add_argument('--memory-stage', nargs=3, metavar=('SCENARIO', 'STAGE', 'WORK_DIR'),
+            help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    stub = args.stub_ricecooker or importlib.util.find_spec('ricecooker') is None
+    if stub:
+        install_stub(quiet=bool(args.memory_stage))
+
+    if args.memory_stage:
+        # Child process started by measure_memory.
+        name, stage, work_dir = args.memory_stage
+        print(json.dumps(run_memory_stage(name, stage, work_dir)))
+        return 0
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scenarios': {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.scenario or sorted(SCENARIOS):
+            results['scenarios'][name] = run_scenario(name, work_dir, args.repeat, stub)
+
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return compare(results, baseline, args.threshold)
+    return 0
+
+
+def install_stub(quiet=False):
+    import ricecooker_stub
+    ricecooker_stub.install()
+    if not quiet:
+        print('Using offline ricecooker stub')
+
+
+def run_scenario(name, work_dir, repeat, stub=False):
+    zip_path = os.path.join(work_dir, '%s.zip' % name)
+    info = synthetic.generate_package(zip_path, **SCENARIOS[name])
+    ims_dir = os.path.join(work_dir, name)
+    with zipfile.ZipFile(zip_path) as zip_file:
+        zip_file.extractall(ims_dir)
+
+    scenario = {'package': info, 'stages': {}}
+    for stage, func in scenario_stages(name, work_dir):
+        result = scenario['stages'][stage] = measure(func, repeat)
+        result.update(measure_memory(name, stage, work_dir, stub))
+    return scenario
+
+
+def scenario_stages(name, work_dir):
+    """Return the (stage, func) pairs of a scenario generated in work_dir."""
+    from imscp import core
+    from imscp.package import ZipPackage
+
+    zip_path = os.path.join(work_dir, '%s.zip' % name)
+    ims_dir = os.path.join(work_dir, name)
+
+    def parse():
+        return core.parse_manifest(ims_dir)[0]
+
+    def walk():
+        root = parse()
+        return [core.walk_items(org) for org in root.findall('organizations/organization', root.nsmap)]
+
+    def resolve():
+        root = parse()
+        resources_dict = dict((r.get('identifier'), r) for r in root.find('resources', root.nsmap))
+        graph = core.ResourceGraph.from_elements(resources_dict)
+        for org in root.findall('organizations/organization', root.nsmap):
+            core.collect_resources(None, core.walk_items(org), resources_dict, ims_dir, graph=graph)
+
+    stages = [
+        ('parse_manifest', parse),
+        ('walk_items', walk),
+        ('collect_resources', resolve),
+        ('extract_from_dir', lambda: core.extract_from_dir(ims_dir, None)),
+        ('extract_from_zip_package', lambda: core.extract_from_dir(ZipPackage(zip_path), None)),
+        ('iter_items', lambda: sum(1 for _ in core.iter_items(ims_dir))),
+    ]
+    if name in BUILD_SCENARIOS:
+        from imscp.ricecooker_utils import make_topic_tree
+        imscp_dict = core.extract_from_dir(ims_dir, None)
+        stages.append(('make_topic_tree', lambda: [
+                make_topic_tree(None, org, ims_dir, temp_dir=work_dir)
+                for org in imscp_dict['organizations']]))
+    return stages
+
+
+def measure(func, repeat):
+    """Return the best wall time of func over repeat runs."""
+    best_seconds = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+    return {'seconds': round(best_seconds, 6)}
+
+
+SPAWN = 'import subprocess, sys; sys.exit(subprocess.call(sys.argv[1:]))'
+
+
+def measure_memory(name, stage, work_dir, stub=False):
+    """Return the peak RSS of running one stage in a fresh Python process.
+
+    Most of the memory of parsing is libxml2's, which tracemalloc can't
+    see, and a process's peak RSS never goes down, so each stage runs once
+    in its own process. The peak includes the interpreter and imports, the
+    same for every stage; start_rss_bytes is the RSS before the stage ran.
+    """
+    # On Linux a process starts out with the peak RSS of the one that
+    # started it, so the stage runs in a grandchild started by a small
+    # Python process rather than by this (much bigger) one.
+    command = [sys.executable, '-c', SPAWN, sys.executable, os.path.abspath(__file__),
+            '--memory-stage', name, stage, work_dir]
+    if stub:
+        command.append('--stub-ricecooker')
+    # Importing ricecooker deletes .ricecooker-temp in the working
+    # directory, where work_dir may be, so the child runs in work_dir.
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(os.path.abspath(path)
+            for path in env.get('PYTHONPATH', '').split(os.pathsep) if path)
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True,
+            universal_newlines=True, cwd=work_dir, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_memory_stage(name, stage, work_dir):
+    func = dict(scenario_stages(name, work_dir))[stage]
+    gc.collect()
+    start = max_rss()
+    func()
+    return {'peak_rss_bytes': max_rss(), 'start_rss_bytes': start}
+
+
+def max_rss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def print_results(results):
+    print('%-18s %-26s %10s %12s %12s' % ('scenario', 'stage', 'seconds', 'peak RSS MB',
+            'stage MB'))
+    for name, scenario in sorted(results['scenarios'].items()):
+        for stage, result in scenario['stages'].items():
+            print('%-18s %-26s %10.4f %12.2f %12.2f' % (name, stage, result['seconds'],
+                    result['peak_rss_bytes'] / 1024 ** 2,
+                    (result['peak_rss_bytes'] - result['start_rss_bytes']) / 1024 ** 2))
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print('\n%-18s %-26s %10s %10s' % ('scenario', 'stage', 'time x', 'memory x'))
+    for name, scenario in sorted(results['scenarios'].items()):
+        base_stages = baseline['scenarios'].get(name, {}).get('stages', {})
+        for stage, result in scenario['stages'].items():
+            base = base_stages.get(stage)
+            if not base:
+                continue
+            time_ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+            # Baselines saved before peak RSS was measured only have
+            # tracemalloc's peak_bytes, which isn't comparable.
+            base_rss = base.get('peak_rss_bytes')
+            memory_ratio = result['peak_rss_bytes'] / base_rss if base_rss else 1.0
+            flag = ''
+            if time_ratio > threshold or memory_ratio > threshold:
+                flag = '  REGRESSION'
+                regressions.append((name, stage))
+            print('%-18s %-26s %10.2f %10.2f%s' % (name, stage, time_ratio, memory_ratio, flag))
+    if regressions:
+        print('\n%d stages regressed by more than %.0f%%' % (len(regressions), (threshold - 1) * 100))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
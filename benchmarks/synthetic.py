@@ -0,0 +1,173 @@
+"""Generate synthetic IMS Content Packages for benchmarking.
+
+Every knob that matters for performance can be varied: tree depth and
+fan-out, the number of files per resource and their size, the shape of the
+dependency graph between resources, how many items carry LOM metadata, and
+whether the manifest is mis-declared as UTF-8.
+
+    python benchmarks/synthetic.py out.zip --depth 4 --fanout 6 --dependencies chain
+"""
+import argparse
+import random
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+
+DEPENDENCY_SHAPES = ('none', 'shared', 'chain', 'cycle')
+
+MANIFEST_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1"
+          xmlns:imsmd="http://www.imsglobal.org/xsd/imsmd_v1p2"
+          xmlns:adlcp="http://www.adlnet.org/xsd/adlcp_rootv1p2"
+          identifier="SYNTHETIC-{seed}">
+"""
+
+LOM_TEMPLATE = """<metadata><imsmd:lom>
+<imsmd:general><imsmd:title><imsmd:langstring xml:lang="es">{title}</imsmd:langstring></imsmd:title>
+{keywords}
+<imsmd:description><imsmd:langstring xml:lang="es">Descripción de {title}</imsmd:langstring></imsmd:description></imsmd:general>
+<imsmd:lifecycle><imsmd:contribute><imsmd:role><imsmd:source>LOMv1.0</imsmd:source><imsmd:value>author</imsmd:value></imsmd:role>
+<imsmd:centity><imsmd:vcard>BEGIN:VCARD FN:Autor {n} END:VCARD</imsmd:vcard></imsmd:centity></imsmd:contribute></imsmd:lifecycle>
+<imsmd:educational><imsmd:context><imsmd:source>LOMv1.0</imsmd:source><imsmd:value>Secundaria</imsmd:value></imsmd:context></imsmd:educational>
+<imsmd:rights><imsmd:cost><imsmd:source>LOMv1.0</imsmd:source><imsmd:value>no</imsmd:value></imsmd:cost></imsmd:rights>
+</imsmd:lom></metadata>
+"""
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta name="author" content="synthetic"><title>{title}</title>
+{links}</head><body><h1>{title}</h1>{body}</body></html>
+"""
+
+
+def generate_package(zip_path, depth=3, fanout=4, files_per_resource=3,
+        file_size=1024, dependencies='shared', shared_files=20, chain_length=5,
+        metadata_density=0.0, bad_encoding=False, seed=0):
+    """Write a synthetic IMSCP zip to zip_path and return some stats about it.
+
+    Args:
+        zip_path - Path of zip file to write.
+        depth - Depth of the item tree below the organization.
+        fanout - Number of children of each topic item.
+        files_per_resource - Asset files of each leaf's own resource.
+        file_size - Size in bytes of each asset file.
+        dependencies - Shape of the <dependency> graph: 'none', 'shared' (every
+            leaf depends on one common resource), 'chain' (a chain of
+            chain_length common resources) or 'cycle' (a chain that loops).
+        shared_files - Number of files in each common resource.
+        chain_length - Number of common resources for 'chain' and 'cycle'.
+        metadata_density - Fraction of items (0 to 1) with LOM metadata.
+        bad_encoding - Encode the manifest as cp1252 while declaring UTF-8.
+        seed - Random seed, so the same arguments give the same package.
+    """
+    if dependencies not in DEPENDENCY_SHAPES:
+        raise ValueError('dependencies must be one of %s' % ', '.join(DEPENDENCY_SHAPES))
+    rng = random.Random(seed)
+    counter = {'items': 0}
+    leaves = []
+
+    def metadata(title, n):
+        if rng.random() >= metadata_density:
+            return ''
+        keywords = ''.join(
+            '<imsmd:keyword><imsmd:langstring>palabra {}</imsmd:langstring></imsmd:keyword>'.format(k)
+            for k in range(5))
+        return LOM_TEMPLATE.format(title=escape(title), keywords=keywords, n=n)
+
+    def items(level):
+        parts = []
+        for _ in range(fanout):
+            counter['items'] += 1
+            n = counter['items']
+            title = 'Lección {} – “{}”'.format(n, 'ñandú' if n % 2 else 'pingüino')
+            if level == depth:
+                leaves.append(n)
+                parts.append('<item identifier="ITEM-{n}" identifierref="RES-{n}"><title>{title}</title>{metadata}</item>'.format(
+                    n=n, title=escape(title), metadata=metadata(title, n)))
+            else:
+                parts.append('<item identifier="ITEM-{n}"><title>{title}</title>{metadata}{children}</item>'.format(
+                    n=n, title=escape(title), metadata=metadata(title, n), children=items(level + 1)))
+        return ''.join(parts)
+
+    organization = items(1)
+    common_ids = []
+    if dependencies == 'shared':
+        common_ids = ['COMMON-0']
+    elif dependencies in ('chain', 'cycle'):
+        common_ids = ['COMMON-%d' % i for i in range(chain_length)]
+
+    files = {}
+    resources = []
+    for i, common_id in enumerate(common_ids):
+        hrefs = ['common/{}/asset{}.js'.format(i, k) for k in range(shared_files)]
+        for href in hrefs:
+            files[href] = _content(rng, file_size)
+        deps = ''
+        if i + 1 < len(common_ids):
+            deps = '<dependency identifierref="%s"/>' % common_ids[i + 1]
+        elif dependencies == 'cycle':
+            deps = '<dependency identifierref="%s"/>' % common_ids[0]
+        resources.append('<resource identifier="{}" type="webcontent" adlcp:scormtype="asset">{}{}</resource>'.format(
+            common_id, ''.join('<file href=%s/>' % quoteattr(href) for href in hrefs), deps))
+
+    for n in leaves:
+        page = 'pages/page{}.html'.format(n)
+        assets = ['pages/page{}/asset{}.bin'.format(n, k) for k in range(files_per_resource)]
+        links = ''.join('<link rel="stylesheet" href="{}">'.format(a) for a in assets)
+        files[page] = PAGE_TEMPLATE.format(title='Página {}'.format(n), links=links,
+                body='<p>contenido</p>' * 20).encode('utf-8')
+        for asset in assets:
+            files[asset] = _content(rng, file_size)
+        deps = '<dependency identifierref="%s"/>' % common_ids[0] if common_ids else ''
+        resources.append('<resource identifier="RES-{n}" type="webcontent" adlcp:scormtype="sco" href="{page}">{files}{deps}</resource>'.format(
+            n=n, page=page, deps=deps,
+            files=''.join('<file href="%s"/>' % href for href in [page] + assets)))
+
+    manifest = ''.join([
+        MANIFEST_HEADER.format(seed=seed),
+        '<organizations default="ORG-1"><organization identifier="ORG-1"><title>Curso sintético</title>',
+        organization,
+        '</organization></organizations><resources>',
+        ''.join(resources),
+        '</resources></manifest>',
+    ])
+    manifest = manifest.encode('cp1252' if bad_encoding else 'utf-8')
+
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('imsmanifest.xml', manifest)
+        for href, content in sorted(files.items()):
+            zip_file.writestr(href, content)
+
+    return {
+        'items': counter['items'],
+        'leaves': len(leaves),
+        'files': len(files),
+        'manifest_bytes': len(manifest),
+    }
+
+
+def _content(rng, size):
+    # Half text, half random bytes, so deflate has something to do.
+    text = (b'var synthetic = "contenido";\n' * (size // 60 + 1))[:size // 2]
+    size -= len(text)
+    return text + (rng.getrandbits(size * 8).to_bytes(size, 'little') if size else b'')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic IMSCP zip.')
+    parser.add_argument('zip_path')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--files-per-resource', type=int, default=3)
+    parser.add_argument('--file-size', type=int, default=1024)
+    parser.add_argument('--dependencies', choices=DEPENDENCY_SHAPES, default='shared')
+    parser.add_argument('--shared-files', type=int, default=20)
+    parser.add_argument('--chain-length', type=int, default=5)
+    parser.add_argument('--metadata-density', type=float, default=0.0)
+    parser.add_argument('--bad-encoding', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = vars(parser.parse_args(argv))
+    print(generate_package(args.pop('zip_path'), **args))
+
+
+if __name__ == '__main__':
+    main()
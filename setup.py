@@ -11,9 +11,7 @@ import imscp
 requirements = [
     "lxml==4.4.1",
     "ricecooker>=0.6.33",
-    "xmltodict==0.12.0",
     "webmixer>=0.0.1",
-    "beautifulsoup4>=4.8.0"
 ]
 
 setup(
@@ -27,7 +25,12 @@ setup(
     packages=find_packages('src'),
     package_dir={'':'src'},
     include_package_data=True,
+    package_data={'imscp': ['js/*.js']},
     install_requires=requirements,
+    python_requires='>=3.7',
+    entry_points={
+        'console_scripts': ['imscp=imscp.cli:main'],
+    },
     license="MIT license",
     zip_safe=False,
     keywords=['imscp', 'ricecooker', 'scorm'],
@@ -36,10 +39,12 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
+        'Programming Language :: Python :: 3.13',
     ],
 )
@@ -0,0 +1,6 @@
+import sys
+
+from imscp.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,276 @@
+import errno
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import time
+
+import imscp
+from imscp.package import ZipPackage, member_name, open_package
+from imscp.ziputils import atomic_write
+
+
+class ZipCache(object):
+    """Persistent, content-addressed cache of built HTML zip files.
+
+    Zips are keyed by a hash of everything that goes into building them, so
+    unchanged apps are reused across runs without copying or compressing
+    anything. Once a run is done (see trim), the least recently used zips
+    past max_size are evicted, except the ones the cache handed out in
+    this run, which nodes still point to.
+
+    Args:
+        cache_dir - Directory to keep cached zip files in. Created if needed.
+        max_size (int, optional) - Maximum total size of the cache in bytes.
+            If not given, the cache is never evicted automatically.
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._pinned = set()
+        self._checksums = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return 'ZipCache(%r, max_size=%r)' % (self.cache_dir, self.max_size)
+
+    def key(self, content_dict, ims_dir, scraper_class=None,
+            needs_scorm_support=False, shared_scorm_zip=False, shared_files=None,
+            compression=None):
+        """Return the cache key of the HTML zip for content_dict.
+
+        Hashes the index file, the resolved file list and the checksum of
+        every file in it (see the packages' checksum), and the options the
+        zip is built with. For a ZipPackage, a file's checksum is the CRC-32
+        and size from the zip's central directory, so nothing is
+        decompressed, at the cost of a (one in 2**32) chance that a changed
+        file of the same size keeps its key.
+        """
+        package = open_package(ims_dir)
+        digest = hashlib.sha256()
+        scraper_name = ''
+        if scraper_class:
+            scraper_name = '%s.%s' % (scraper_class.__module__, scraper_class.__qualname__)
+        for part in (imscp.__version__, scraper_name, str(bool(needs_scorm_support)),
+                str(bool(shared_scorm_zip))):
+            digest.update(part.encode('utf-8') + b'\0')
+        if compression is not None:
+            digest.update(repr(compression).encode('utf-8') + b'\0')
+        for name, base_url in sorted((shared_files or {}).items()):
+            digest.update(('%s=%s' % (name, base_url)).encode('utf-8') + b'\0')
+
+        for href in [content_dict['index_file']] + list(content_dict['files']):
+            checksum = self._checksum(package, href)
+            digest.update(('%s=%s\0' % (href, checksum or '<missing>')).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _checksum(self, package, href):
+        # Memoized, as dependency files are shared by many leaves. Checksums
+        # are looked up again whenever the size or mtime of the file (or,
+        # for a ZipPackage, of the zip) changed, e.g. when a new version of
+        # a package is written to the same path.
+        name = member_name(href)
+        path = package.zip_file_path if isinstance(package, ZipPackage) else package.path(name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        memo_key = (path, stat.st_size, stat.st_mtime_ns, name)
+        checksum = self._checksums.get(memo_key)
+        if checksum is None:
+            checksum = self._checksums[memo_key] = package.checksum(name)
+        return checksum
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, '%s.zip' % key)
+
+    def get(self, key):
+        """Return the path of the cached zip for key, or None on a miss."""
+        path = self.path(key)
+        try:
+            # Bump the mtime, which is what LRU eviction goes by.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        logging.debug('Zip cache hit %s' % key)
+        self.pin(path)
+        return path
+
+    def put(self, key, zip_path):
+        """Move the zip at zip_path into the cache and return its cached path.
+
+        zip_path no longer exists afterwards.
+        """
+        path = self.path(key)
+        try:
+            os.replace(zip_path, path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # On another filesystem: copy it instead.
+            with open(zip_path, 'rb') as src, atomic_write(path) as dest:
+                shutil.copyfileobj(src, dest)
+            os.remove(zip_path)
+        self.pin(path)
+        return path
+
+    def pin(self, zip_path):
+        """Keep the cached zip at zip_path from being evicted by this cache.
+
+        get and put pin the zips they return. Zips built by worker
+        processes are pinned in their copy of the cache, so pin them again
+        here once their paths are returned.
+        """
+        self._pinned.add(os.path.abspath(zip_path))
+
+    def release(self):
+        """Let every pinned zip be evicted again, e.g. once the nodes using them are uploaded."""
+        self._pinned.clear()
+
+    def trim(self):
+        """Evict the least recently used zips past max_size, if there is one.
+
+        Called at the end of make_topic_tree. Pinned zips are kept.
+        """
+        if self.max_size is None:
+            return 0
+        return self.evict(self.max_size)
+
+    def entries(self):
+        """Return a list of (key, size in bytes, last used timestamp) tuples.
+
+        Sorted from least to most recently used.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.zip'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry.name[:-len('.zip')], stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def size(self):
+        """Return the total size of the cached zips in bytes."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_size):
+        """Remove least recently used zips until the cache fits in max_size.
+
+        Pinned zips are never removed, even if that leaves the cache over
+        max_size. Return the number of zips removed.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for key, size, _ in entries:
+            if total <= max_size:
+                break
+            if os.path.abspath(self.path(key)) in self._pinned:
+                continue
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            logging.info('Evicted %d zips from %s' % (removed, self.cache_dir))
+        return removed
+
+    def clear(self):
+        """Remove every zip from the cache, pinned or not."""
+        self.release()
+        return self.evict(0)
+
+    def stats(self):
+        """Return a dict summarizing the contents of the cache."""
+        entries = self.entries()
+        return {
+            'cache_dir': self.cache_dir,
+            'count': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size,
+            'oldest': time.ctime(entries[0][2]) if entries else None,
+        }
+
+
+# Version of the results ParseCache stores, bumped whenever the dicts
+# extract_from_dir returns change, so older entries are ignored.
+PARSE_RESULT_FORMAT = '2'
+
+
+class ParseCache(object):
+    """Persistent cache of extract_from_dir results.
+
+    Results are keyed by a hash of imsmanifest.xml, the imscp version and
+    the metadata sections collected, so a manifest that was parsed before
+    (e.g. by another step of a chef, or a retry) is loaded from a pickle
+    instead of being parsed and resolved again. The manifest is read from
+    the package to hash it, so a ZipPackage is never extracted. Each result
+    is its own file, only read when it is looked up.
+
+    Args:
+        cache_dir - Directory to keep cached results in. Created if needed.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return 'ParseCache(%r)' % self.cache_dir
+
+    def key(self, ims_dir, metadata_sections=()):
+        """Return the cache key of the manifest of an IMSCP directory or ZipPackage."""
+        package = open_package(ims_dir)
+        digest = hashlib.sha256()
+        for part in (imscp.__version__, PARSE_RESULT_FORMAT, ','.join(metadata_sections)):
+            digest.update(part.encode('utf-8') + b'\0')
+        with package.open('imsmanifest.xml') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, '%s.pickle' % key)
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss."""
+        try:
+            with open(self.path(key), 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            logging.warning('Ignoring unreadable parse cache entry %s: %s' % (key, e))
+            return None
+        logging.debug('Parse cache hit %s' % key)
+        return result
+
+    def put(self, key, result):
+        """Add an extract_from_dir result to the cache."""
+        try:
+            with atomic_write(self.path(key)) as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # pickle recurses into nested items, which is too deep for
+            # some manifests; those are just parsed every time.
+            logging.warning('Not caching result %s, its tree is too deep to pickle' % key)
+
+    def clear(self):
+        """Remove every result from the cache. Return the number removed."""
+        removed = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pickle'):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
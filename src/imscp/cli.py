@@ -0,0 +1,234 @@
+"""Command line entry point to ingest whole directories of IMSCP packages.
+
+Each package is parsed straight from its zip (and, with --build, converted
+to a topic tree) in a pool of worker processes. The result is written to
+one JSON file per package, and every finished package is recorded in a
+journal so that an interrupted run picks up where it stopped.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from imscp.cache import ParseCache
+from imscp.core import extract_from_dir
+from imscp.package import ZipPackage
+from imscp.stats import PipelineStats
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.temp_dir:
+        os.makedirs(args.temp_dir, exist_ok=True)
+    journal_path = args.journal or os.path.join(args.output_dir, 'journal.jsonl')
+    done = set() if args.restart else read_journal(journal_path)
+
+    packages = find_packages(args.packages)
+    pending = [p for p in packages if os.path.abspath(p) not in done]
+    skipped = len(packages) - len(pending)
+    if skipped:
+        print('Skipping %d packages already in %s' % (skipped, journal_path))
+
+    options = {
+        'output_dir': args.output_dir,
+        'summary': args.summary,
+        'build': args.build,
+        'license_id': args.license,
+        'copyright_holder': args.copyright_holder,
+        'temp_dir': args.temp_dir,
+        'parse_cache': args.parse_cache,
+    }
+    stats = {'ok': 0, 'error': 0, 'bytes': 0}
+    start = time.time()
+    with open(journal_path, 'a') as journal, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = dict((executor.submit(ingest_package, path, options), path)
+                for path in pending)
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                logging.exception('Failed to ingest %s' % path)
+                entry = {'package': os.path.abspath(path), 'status': 'error', 'error': repr(e)}
+            stats[entry['status']] += 1
+            stats['bytes'] += entry.get('bytes', 0)
+            # Flush every entry, so a killed run loses nothing it finished.
+            journal.write(json.dumps(entry) + '\n')
+            journal.flush()
+            print('[%d/%d] %s %s' % (stats['ok'] + stats['error'], len(pending),
+                    entry['status'], path))
+
+    elapsed = time.time() - start
+    print('Ingested %d packages (%d failed, %d skipped) in %.1fs: '
+            '%.2f packages/s, %.2f MB/s' % (
+                stats['ok'], stats['error'], skipped, elapsed,
+                stats['ok'] / elapsed if elapsed else 0,
+                stats['bytes'] / 1024 ** 2 / elapsed if elapsed else 0))
+    return 1 if stats['error'] else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='imscp', description=(
+        'Extract the topic trees of IMSCP packages in parallel, writing one '
+        'JSON file per package.'))
+    parser.add_argument('packages', nargs='+',
+            help='IMSCP zip files, or directories to look for them in.')
+    parser.add_argument('-o', '--output-dir', default='imscp-output',
+            help='Directory to write JSON files and the journal to.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='Number of worker processes. Defaults to the number of CPUs.')
+    parser.add_argument('--summary', action='store_true',
+            help='Write a short summary of each package instead of its whole tree.')
+    parser.add_argument('--build', action='store_true',
+            help='Also build the ricecooker topic tree and HTML zips of each package.')
+    parser.add_argument('--license', default='CC BY-SA',
+            help='License id of built content nodes (with --build).')
+    parser.add_argument('--copyright-holder', default='',
+            help='Copyright holder of built content nodes (with --build).')
+    parser.add_argument('--temp-dir', default=None,
+            help='Directory to output built HTML zip files to (with --build).')
+    parser.add_argument('--parse-cache', default=None,
+            help='Directory to cache parsed manifests in, so that packages '
+            'ingested again (e.g. after a failed run) skip parsing.')
+    parser.add_argument('--journal', default=None,
+            help='Journal file of finished packages. Defaults to '
+            'OUTPUT_DIR/journal.jsonl.')
+    parser.add_argument('--restart', action='store_true',
+            help='Ignore the journal and ingest every package again.')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def find_packages(paths):
+    """Return the IMSCP zip files in paths, searching directories recursively."""
+    packages = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                dirs.sort()
+                packages.extend(os.path.join(root, filename)
+                        for filename in sorted(filenames)
+                        if filename.lower().endswith('.zip'))
+        else:
+            packages.append(path)
+    return packages
+
+
+def read_journal(journal_path):
+    """Return the set of packages the journal records as done."""
+    done = set()
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path) as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of a killed run may be cut off.
+                continue
+            if entry.get('status') == 'ok':
+                done.add(entry['package'])
+    return done
+
+
+def ingest_package(path, options):
+    """Extract (and optionally build) one package and write its JSON file.
+
+    Runs in a worker process. Returns the journal entry for the package,
+    including the stage timings and counters of its PipelineStats report.
+    """
+    start = time.time()
+    output_path = os.path.join(options['output_dir'], output_name(path))
+    stats = PipelineStats(os.path.abspath(path))
+
+    with tempfile.TemporaryDirectory() as extract_path:
+        package = ZipPackage(path, extract_path)
+        parse_cache = ParseCache(options['parse_cache']) if options['parse_cache'] else None
+        imscp_dict = extract_from_dir(package, None, stats=stats, parse_cache=parse_cache)
+        if options['build']:
+            imscp_dict['topic_trees'] = build_topic_trees(imscp_dict, package, options, stats)
+
+    result = summarize(imscp_dict) if options['summary'] else imscp_dict
+    with open(output_path, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    return {
+        'package': os.path.abspath(path),
+        'status': 'ok',
+        'output': output_path,
+        'bytes': os.path.getsize(path),
+        'seconds': round(time.time() - start, 3),
+        'stats': stats.report(),
+    }
+
+
+def output_name(path):
+    """Return the name of the JSON file of the package at path.
+
+    Packages with the same file name in different directories are told
+    apart by a short hash of their absolute path, e.g. course-1f3a9c2e.json.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return '%s-%s.json' % (name, digest[:8])
+
+
+def build_topic_trees(imscp_dict, package, options, stats=None):
+    # ricecooker is only needed when building, so import it here.
+    from ricecooker.classes import licenses
+    from imscp.ricecooker_utils import make_topic_tree
+
+    license = licenses.get_license(options['license_id'],
+            copyright_holder=options['copyright_holder'])
+    return [node_dict(make_topic_tree(license, topic_dict, package,
+                    temp_dir=options['temp_dir'], stats=stats))
+            for topic_dict in imscp_dict['organizations']]
+
+
+def node_dict(node):
+    """Return a JSON-serializable dict of a ricecooker node tree."""
+    if node is None:
+        return None
+    result = {
+        'source_id': node.source_id,
+        'title': node.title,
+        'kind': getattr(node, 'kind', 'topic'),
+        'files': [f.path for f in getattr(node, 'files', [])],
+    }
+    if node.children:
+        result['children'] = [node_dict(child) for child in node.children]
+    return result
+
+
+def summarize(imscp_dict):
+    """Return counts and sizes describing an extract_from_dir dict."""
+    counts = {'items': 0, 'leaves': 0, 'webcontent': 0, 'files': 0}
+    pending = [child for org in imscp_dict['organizations']
+            for child in org.get('children', [])]
+    while pending:
+        item = pending.pop()
+        counts['items'] += 1
+        if item.get('children'):
+            pending.extend(item['children'])
+        else:
+            counts['leaves'] += 1
+            if item.get('type') == 'webcontent':
+                counts['webcontent'] += 1
+                counts['files'] += len(item.get('files', []))
+    return dict(counts,
+        identifier=imscp_dict['identifier'],
+        organizations=[org.get('title') for org in imscp_dict['organizations']],
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import posixpath
+import zipfile
+
+
+# Formats that are already compressed, which deflate can't make smaller.
+STORED_EXTENSIONS = (
+    '.mp4', '.m4v', '.webm', '.ogv', '.mov', '.flv',
+    '.mp3', '.m4a', '.aac', '.ogg', '.oga', '.opus',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp',
+    '.woff', '.woff2',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.svgz', '.epub', '.docx', '.pptx', '.xlsx',
+)
+
+# Text formats, which large_text_level applies to.
+TEXT_EXTENSIONS = ('.html', '.htm', '.xhtml', '.xml', '.css', '.js', '.json', '.svg', '.txt', '.vtt', '.srt')
+
+
+class CompressionPolicy(object):
+    """Decides how each member of an HTML zip is compressed.
+
+    Pass one to make_topic_tree (or create_html5_app_node,
+    make_topic_tree_with_entrypoints or SharedAssets.build) as compression.
+    Members in already compressed formats are stored rather than deflated,
+    which costs almost no size and skips most of the CPU time of building
+    zips of media-heavy apps. Other members are deflated at level, or at
+    the level given for their extension. The choice only depends on a
+    member's name and size, so zips are still the same every time they are
+    built. Without a policy every member is deflated at zlib's default
+    level, like ricecooker's create_predictable_zip.
+
+    Args:
+        level (int, optional) - Deflate level of members not stored.
+        store_extensions (optional) - Extensions of the members to store.
+        levels (dict, optional) - Extension -> deflate level overrides,
+            e.g. {'.svg': 9}.
+        large_text_level (int, optional) - Deflate level of text members of
+            at least large_size bytes, e.g. 1 to build zips with big
+            JavaScript libraries faster.
+        large_size (int, optional) - Size in bytes from which large_text_level
+            applies.
+    """
+
+    def __init__(self, level=6, store_extensions=STORED_EXTENSIONS, levels=None,
+            large_text_level=None, large_size=1024 * 1024):
+        self.level = level
+        self.store_extensions = frozenset(ext.lower() for ext in store_extensions)
+        self.levels = dict((ext.lower(), ext_level) for ext, ext_level in (levels or {}).items())
+        self.large_text_level = large_text_level
+        self.large_size = large_size
+
+    def __repr__(self):
+        # Also used in cache keys and fingerprints, so it is deterministic.
+        return 'CompressionPolicy(level=%r, store_extensions=%r, levels=%r, large_text_level=%r, large_size=%r)' % (
+                self.level, sorted(self.store_extensions), sorted(self.levels.items()),
+                self.large_text_level, self.large_size)
+
+    def method(self, name, size):
+        """Return (compress_type, level) for a member of a zip.
+
+        level is None for stored members.
+        """
+        ext = posixpath.splitext(name)[1].lower()
+        if ext in self.store_extensions:
+            return zipfile.ZIP_STORED, None
+        if ext in self.levels:
+            return zipfile.ZIP_DEFLATED, self.levels[ext]
+        if (self.large_text_level is not None and size >= self.large_size
+                and ext in TEXT_EXTENSIONS):
+            return zipfile.ZIP_DEFLATED, self.large_text_level
+        return zipfile.ZIP_DEFLATED, self.level
+
@@ -1,38 +1,64 @@
+import codecs
+import collections
 import io
 import itertools
 import logging
-import os
 import re
-import shutil
-import tempfile
-import zipfile
+import sys
 
-import chardet
+from chardet.universaldetector import UniversalDetector
 from lxml import etree
-import xmltodict
 
+from imscp.filters import filter_tree
+from imscp.items import Item
+from imscp.package import ZipPackage, open_package
+from imscp.stats import NULL_STATS
 
-def extract_from_zip(zip_file_path, license, extract_path=None):
+
+LOM_SECTIONS = ('general', 'rights', 'educational', 'lifecycle')
+
+
+def extract_from_zip(zip_file_path, license, extract_path=None, stats=None,
+        parse_cache=None, item_filter=None):
     """Extract metadata and topic tree info from an IMSCP zip.
 
     Return a dict {'metadata': {...}, 'organizations': [list of topic dicts]}
 
+    The manifest is read (or looked up in parse_cache) straight from the zip,
+    and then the whole zip is extracted, since the result refers to its files
+    in extract_path. With an item_filter, only the manifest and the files of
+    the selected leaves are extracted. To only extract the files that are
+    actually needed, pass a ZipPackage to extract_from_dir and make_topic_tree
+    instead.
+
     Args:
         zip_file_path - Path to IMSCP zip file.
         license - License to apply to content nodes.
         extract_path (optional) - Path of directory to extract zip file to. If
             not given, a temporary one will be created (but not cleaned up).
+        stats (imscp.stats.PipelineStats, optional) - Stats to record stage
+            timings and counters into.
+        parse_cache (imscp.cache.ParseCache, optional) - See extract_from_dir.
+        item_filter (imscp.filters.ItemFilter, optional) - See extract_from_dir.
     """
-    if not extract_path:
-        extract_path = tempfile.mkdtemp()
-
-    logging.info('Extracting zip file %s to %s' % (zip_file_path, extract_path))
-    zip_file = zipfile.ZipFile(zip_file_path)
-    zip_file.extractall(extract_path)
-    return extract_from_dir(extract_path, license)
-
-
-def extract_from_dir(ims_dir, license):
+    stats = stats or NULL_STATS
+    package = ZipPackage(zip_file_path, extract_path)
+    result = extract_from_dir(package, license, stats=stats, parse_cache=parse_cache,
+            item_filter=item_filter)
+    if item_filter is not None:
+        with stats.stage('extract_zip'):
+            package.extract(['imsmanifest.xml'] + _leaf_files(result['organizations']),
+                    stats=stats)
+        return result
+    with stats.stage('extract_zip'):
+        package.extract_all()
+    stats.incr('files_extracted', len(package.members))
+    stats.incr('bytes_extracted', sum(info.file_size for info in package.members.values()))
+    return result
+
+
+def extract_from_dir(ims_dir, license, metadata_sections=LOM_SECTIONS,
+        stats=None, compact=False, parse_cache=None, item_filter=None):
     """Extract metadata and topic tree info from an IMSCP directory.
 
     Return a dict {'metadata': {...}, 'organizations': [list of topic dicts]}
@@ -40,23 +66,52 @@ def extract_from_dir(ims_dir, license):
     Like extract_from_zip but assumes zip file has been extracted already.
 
     Args:
-        ims_dir - Directory of extracted IMS Content Package.
+        ims_dir - Directory of extracted IMS Content Package, or a ZipPackage
+            to read the manifest straight from the zip without extracting it.
         license - License to apply to content nodes.
+        metadata_sections (optional) - LOM sections to collect metadata from.
+        stats (imscp.stats.PipelineStats, optional) - Stats to record stage
+            timings and counters into.
+        compact (optional) - Return organizations and items as
+            imscp.items.Item objects, which refer to their resources
+            instead of copying them. They can be used like the dicts
+            but take less memory on big manifests.
+        parse_cache (imscp.cache.ParseCache, optional) - Cache to load the
+            result from if the same manifest was extracted before, and to
+            add it to otherwise.
+        item_filter (imscp.filters.ItemFilter, optional) - Only extract
+            the selected organizations and items. Resources are only
+            resolved for the selected leaves. With a parse_cache, the whole
+            package is cached and the filter applied to the cached result.
     """
-    logging.info('Parsing imsmanifest.xml in %s' % ims_dir)
-    manifest_path = os.path.join(ims_dir, 'imsmanifest.xml')
-    try:
-        manifest_root = etree.parse(manifest_path).getroot()
-    except etree.XMLSyntaxError:
-        # we've run across XML files that are marked as UTF-8 encoded but which have non-UTF-8 characters in them
-        # for this case, detect the 'real' encoding and decode it as unicode, then make it actual UTF-8 and parse.
-        f = open(manifest_path, 'rb')
-        data = f.read()
-        f.close()
-
-        info = chardet.detect(data)
-        data = data.decode(info['encoding'])
-        manifest_root = etree.parse(io.BytesIO(data.encode('utf-8'))).getroot()
+    stats = stats or NULL_STATS
+    package = open_package(ims_dir)
+    if parse_cache is not None:
+        with stats.stage('parse_cache_key'):
+            key = parse_cache.key(package, metadata_sections)
+        with stats.stage('parse_cache_get'):
+            result = parse_cache.get(key)
+        if result is None:
+            stats.incr('parse_cache_misses')
+            result = extract_from_dir(package, license, metadata_sections, stats=stats)
+            with stats.stage('parse_cache_put'):
+                parse_cache.put(key, result)
+        else:
+            stats.incr('parse_cache_hits')
+        if item_filter is not None:
+            result['organizations'] = [tree for tree in (
+                    filter_tree(org, item_filter) for org in result['organizations']
+                    if item_filter.accepts_organization(org.get('identifier')))
+                if tree is not None]
+        if compact:
+            result['organizations'] = [Item.from_dict(org) for org in result['organizations']]
+        return result
+
+    logging.info('Parsing imsmanifest.xml in %s' % package)
+    with stats.stage('parse_manifest'):
+        manifest_root, strategy = parse_manifest(package, stats=stats)
+    logging.info('Parsed imsmanifest.xml using %s' % strategy)
+    stats.set('encoding_strategy', strategy)
 
     nsmap = manifest_root.nsmap
 
@@ -65,16 +120,34 @@ def extract_from_dir(ims_dir, license):
     metadata_elem = manifest_root.find('metadata', nsmap)
     metadata = {}
     if metadata_elem is not None:
-        metadata = collect_metadata(metadata_elem)
+        with stats.stage('collect_metadata'):
+            metadata = collect_metadata(metadata_elem, metadata_sections)
+
+    organizations = []
+    for org_elem in manifest_root.findall('organizations/organization', nsmap):
+        if item_filter is not None and not item_filter.accepts_organization(org_elem.get('identifier')):
+            continue
+        with stats.stage('walk_items'):
+            item_tree = walk_items(org_elem, metadata_sections, stats=stats,
+                    compact=compact, item_filter=item_filter)
+        if item_tree is not None:
+            organizations.append(item_tree)
 
     resources_elem = manifest_root.find('resources', nsmap)
+    if resources_elem is None:
+        logging.warning('imsmanifest.xml has no <resources>')
+        resources_elem = ()
     resources_dict = dict((r.get('identifier'), r) for r in resources_elem)
+    if item_filter is not None:
+        resources_dict = _needed_resources(resources_dict, organizations)
 
-    organizations = []
-    for org_elem in manifest_root.findall('organizations/organization', nsmap):
-        item_tree = walk_items(org_elem)
-        collect_resources(license, item_tree, resources_dict, ims_dir)
-        organizations.append(item_tree)
+    graph = ResourceGraph.from_elements(resources_dict)
+    for item_tree in organizations:
+        with stats.stage('resolve_resources'):
+            collect_resources(license, item_tree, resources_dict, package, graph=graph)
+    stats.incr('resources', len(graph.resources))
+    stats.incr('resources_resolved', graph.resolved)
+    stats.incr('dependency_cycles', len(graph.cycles))
 
     return {
         'identifier': manifest_root.get('identifier'),
@@ -83,49 +156,488 @@ def extract_from_dir(ims_dir, license):
     }
 
 
-def walk_items(root):
+def _needed_resources(resources_dict, item_trees):
+    # Return the <resource> elements the leaves of item_trees refer to,
+    # directly or through dependencies.
+    needed = {}
+    pending = []
+    items = list(item_trees)
+    while items:
+        item = items.pop()
+        if item.get('children'):
+            items.extend(item['children'])
+        elif item.get('identifierref'):
+            pending.append(item['identifierref'])
+    while pending:
+        identifier = pending.pop()
+        if identifier in needed or identifier not in resources_dict:
+            continue
+        elem = needed[identifier] = resources_dict[identifier]
+        pending.extend(de.get('identifierref') for de in elem.findall('dependency', elem.nsmap))
+    return needed
+
+
+def _leaf_files(item_trees):
+    # Return the hrefs of the index files and files of the leaves of item_trees.
+    hrefs = []
+    items = list(item_trees)
+    while items:
+        item = items.pop()
+        if item.get('children'):
+            items.extend(item['children'])
+            continue
+        if item.get('index_file'):
+            hrefs.append(item['index_file'])
+        hrefs.extend(item.get('files') or [])
+    return hrefs
+
+
+def parse_manifest(ims_dir, stats=None):
+    """Parse imsmanifest.xml, recovering from encoding problems.
+
+    Return (root element, strategy), where strategy says how the manifest
+    was parsed: 'declared' if it parsed as is, otherwise one of the
+    strategies of decode_manifest, or 'recover' if it could only be parsed
+    by lxml's recovering parser.
+
+    Only encoding errors are recovered from: the XMLSyntaxError of a
+    malformed manifest is raised, and so is a ValueError if recover mode
+    drops any <organization> or <resource>.
+
+    Args:
+        ims_dir - Directory of extracted IMS Content Package, or a ZipPackage.
+        stats (imscp.stats.PipelineStats, optional) - Stats to record the
+            manifest size and any encoding recovery into.
+    """
+    stats = stats or NULL_STATS
+    package = open_package(ims_dir)
+    try:
+        with package.open('imsmanifest.xml') as f:
+            root = etree.parse(f, MANIFEST_PARSER).getroot()
+            stats.incr('manifest_bytes_read', f.tell())
+            return root, 'declared'
+    except (etree.XMLSyntaxError, OSError) as e:
+        # we've run across XML files that are marked as UTF-8 encoded but which have non-UTF-8 characters in them
+        # for this case, find the 'real' encoding and decode it as unicode, then make it actual UTF-8 and parse.
+        # Other syntax errors (e.g. a truncated manifest) can't be fixed by decoding it.
+        if not is_encoding_error(e):
+            raise
+        error = e
+        with package.open('imsmanifest.xml') as f:
+            data = f.read()
+    stats.incr('manifest_bytes_read', len(data))
+
+    with stats.stage('encoding_recovery'):
+        for strategy, utf8_data in decode_manifest(data):
+            try:
+                return etree.fromstring(utf8_data, UTF8_PARSER), strategy
+            except etree.XMLSyntaxError:
+                continue
+        logging.warning('Could not decode imsmanifest.xml, parsing it in recover mode')
+        root = etree.fromstring(data, etree.XMLParser(recover=True, huge_tree=True))
+        check_recovered(root, data, error)
+        return root, 'recover'
+
+
+# libxml2 errors raised when a document isn't in the encoding it declares
+# (or that libxml2 guessed), rather than malformed.
+ENCODING_ERRORS = frozenset((
+    etree.ErrorTypes.ERR_DOCUMENT_EMPTY,
+    etree.ErrorTypes.ERR_INVALID_CHAR,
+    etree.ErrorTypes.ERR_UNKNOWN_ENCODING,
+    etree.ErrorTypes.ERR_UNSUPPORTED_ENCODING,
+    etree.ErrorTypes.ERR_ENCODING_NAME,
+    etree.ErrorTypes.ERR_INVALID_ENCODING,
+))
+
+
+def is_encoding_error(error):
+    """Return whether an error parsing a manifest may be fixed by decoding it differently."""
+    if isinstance(error, etree.XMLSyntaxError):
+        return error.code in ENCODING_ERRORS
+    # Depending on the lxml version, encoding errors can also be an OSError
+    # ("Invalid bytes in character encoding"), unlike a missing manifest.
+    return not isinstance(error, (FileNotFoundError, IsADirectoryError, PermissionError))
+
+
+RECOVERED_TAG_RE = re.compile(br'<(?:[\w.-]+:)?(organization|resource)[\s/>]')
+COMMENT_RE = re.compile(br'<!--.*?-->', re.S)
+
+
+def check_recovered(root, data, error=None):
+    """Raise ValueError if recover mode dropped organizations or resources of the manifest.
+
+    Compares the elements parsed with the <organization> and <resource> tags
+    in data, the manifest's bytes.
+    """
+    expected = collections.Counter(match.group(1).decode('ascii')
+            for match in RECOVERED_TAG_RE.finditer(COMMENT_RE.sub(b'', data)))
+    parsed = collections.Counter()
+    if root is not None:
+        for elem in root.iter('{*}organization', '{*}resource', 'organization', 'resource'):
+            parsed[etree.QName(elem).localname] += 1
+    dropped = ['%d of %d %ss' % (expected[tag] - parsed[tag], expected[tag], tag)
+            for tag in ('organization', 'resource') if parsed[tag] < expected[tag]]
+    if root is None or dropped:
+        raise ValueError('imsmanifest.xml is malformed (%s), and recovering it dropped %s' % (
+                error, ' and '.join(dropped) or 'everything'))
+
+
+# huge_tree lifts libxml2's limit of 256 nested elements (and of very large
+# text nodes), which big manifests can reach.
+MANIFEST_PARSER = etree.XMLParser(huge_tree=True)
+UTF8_PARSER = etree.XMLParser(encoding='utf-8', huge_tree=True)
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Tried in order when the declared encoding is wrong. Nearly every
+# mis-declared manifest we've seen is Windows-1252 (or a subset of it).
+FALLBACK_ENCODINGS = ('utf-8', 'cp1252')
+
+XML_DECLARATION_RE = re.compile(br'^\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+
+
+def decode_manifest(data):
+    """Yield (strategy, UTF-8 encoded data) for each way data can be decoded.
+
+    Cheapest first: the byte order mark, then the fallback encodings (minus
+    the one the XML declaration claims, which has already failed), then
+    chardet's incremental detector, stopped as soon as it is confident, and
+    finally latin-1, which can decode anything. Candidates are produced
+    lazily, so later ones are only computed if the earlier ones don't parse.
+    """
+    encodings = []
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            encodings.append(('bom', encoding))
+            break
+
+    declared = XML_DECLARATION_RE.match(data[:1024])
+    declared = codecs.lookup(declared.group(1).decode('ascii')).name if declared else 'utf-8'
+    encodings.extend((encoding, encoding) for encoding in FALLBACK_ENCODINGS
+            if codecs.lookup(encoding).name != declared)
+
+    for strategy, encoding in itertools.chain(encodings, _detect_encoding(data), [('latin-1', 'latin-1')]):
+        try:
+            text = data.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            continue
+        yield strategy, text.encode('utf-8')
+
+
+def _detect_encoding(data, chunk_size=64 * 1024):
+    detector = UniversalDetector()
+    for start in range(0, len(data), chunk_size):
+        detector.feed(data[start:start + chunk_size])
+        if detector.done:
+            break
+    detector.close()
+    if detector.result['encoding']:
+        yield 'detected:%s' % detector.result['encoding'], detector.result['encoding']
+
+
+StreamedItem = collections.namedtuple('StreamedItem', ['path', 'item', 'is_leaf'])
+
+
+def iter_items(ims_dir, license=None, metadata_sections=LOM_SECTIONS):
+    """Stream the items of an IMSCP manifest without building its whole tree.
+
+    Yield a StreamedItem(path, item, is_leaf) for every organization and item
+    in tree order, parents before their children. path is the tuple of
+    identifiers of the item's ancestors, starting with its organization (so
+    it is empty for organizations). item is a dict like the ones in
+    extract_from_dir, but without 'children'; the resources of leaves are
+    already collected.
+
+    The manifest is parsed with iterparse and every element is freed as soon
+    as it has been handled; only compact data about each resource is kept.
+
+    Args:
+        ims_dir - Directory of extracted IMS Content Package, or a ZipPackage.
+        license - License to apply to content nodes.
+        metadata_sections (optional) - LOM sections to collect metadata from.
+    """
+    package = open_package(ims_dir)
+    open_manifest = lambda: package.open('imsmanifest.xml')
+    encoding = None
+    try:
+        with open_manifest() as f:
+            resources = _stream_resources(f)
+    except (etree.XMLSyntaxError, OSError) as e:
+        if not is_encoding_error(e):
+            raise
+        # The first pass reads nothing to the caller, so it can just start
+        # over with the manifest decoded by the first encoding that works.
+        with open_manifest() as f:
+            strategy, data = next(decode_manifest(f.read()))
+        logging.info('Parsing imsmanifest.xml using %s' % strategy)
+        open_manifest = lambda: io.BytesIO(data)
+        encoding = 'utf-8'
+        with open_manifest() as f:
+            resources = _stream_resources(f, encoding)
+    graph = ResourceGraph(resources)
+
+    # Stack of [element, item dict, emitted?] for the open organization/items.
+    stack = []
+    with open_manifest() as f:
+        for event, elem in etree.iterparse(f, events=('start', 'end'), encoding=encoding,
+                huge_tree=True, tag=('{*}organizations', '{*}organization', '{*}item', '{*}resource')):
+            localname = etree.QName(elem).localname
+            if localname in ('organizations', 'resource'):
+                if event == 'end':
+                    if localname == 'organizations':
+                        break
+                    _free(elem)
+                continue
+
+            path = tuple(frame[1].get('identifier') for frame in stack)
+            if event == 'start':
+                if stack and not stack[-1][2]:
+                    # The parent's title and metadata come before its first
+                    # child item, so it can be emitted now.
+                    parent = stack[-1]
+                    parent[2] = True
+                    yield StreamedItem(path[:-1], item_dict(parent[0], metadata_sections), False)
+                stack.append([elem, dict(elem.items()), False])
+            else:
+                _, item, emitted = stack.pop()
+                if not emitted:
+                    item = item_dict(elem, metadata_sections)
+                    is_leaf = localname == 'item'
+                    if is_leaf and item.get('identifierref'):
+                        collect_resource(item, graph)
+                    yield StreamedItem(path[:-1], item, is_leaf)
+                _free(elem)
+
+
+def _stream_resources(manifest_file, encoding=None):
+    """Return a dict of identifier -> resource_record for every <resource>."""
+    resources = {}
+    for event, elem in etree.iterparse(manifest_file, events=('end',), encoding=encoding,
+            huge_tree=True, tag=('{*}item', '{*}resource', '{*}resources')):
+        localname = etree.QName(elem).localname
+        if localname == 'resources':
+            break
+        if localname == 'resource':
+            resources[elem.get('identifier')] = resource_record(elem)
+        _free(elem)
+    return resources
+
+
+def _free(elem):
+    """Free an element handled by iterparse, and its already handled siblings."""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def walk_items(root, metadata_sections=LOM_SECTIONS, stats=None, compact=False,
+        item_filter=None):
+    """Return the dict of an <organization> or <item> and all its descendants.
+
+    Walks the tree iteratively, so it can be as deep as the manifest is.
+    With compact, items are imscp.items.Item objects instead of dicts. With
+    an imscp.filters.ItemFilter, only the selected items and the topics
+    above them are converted, and None is returned if there are none.
+    """
+    make_item = Item if compact else dict
+    selected = ancestors = None
+    if item_filter is not None and item_filter.filters_items:
+        selected, ancestors = _select_elements(root, item_filter)
+        if root not in selected and root not in ancestors:
+            return None
+
+    root_item = make_item(item_dict(root, metadata_sections, stats))
+    pending = [(root, root_item, selected is None or root in selected)]
+    while pending:
+        elem, item, whole = pending.pop()
+        child_elems = elem.findall('item', elem.nsmap)
+        if not whole:
+            child_elems = [child for child in child_elems
+                    if child in selected or child in ancestors]
+        children = [(child, make_item(item_dict(child, metadata_sections, stats)),
+                     whole or child in selected)
+                for child in child_elems]
+        if children:
+            item['children'] = [child_item for _, child_item, _ in children]
+            pending.extend(reversed(children))
+    return root_item
+
+
+def _select_elements(root, item_filter):
+    # Return the sets of elements item_filter selects under root (whose
+    # whole subtrees are kept) and of their ancestors, reading only titles.
+    selected = set()
+    ancestors = set()
+    pending = [(root, (element_title(root),))]
+    while pending:
+        elem, path = pending.pop()
+        if item_filter.selects(path, elem.get('identifier'), elem.get('identifierref')):
+            selected.add(elem)
+            while elem is not root:
+                elem = elem.getparent()
+                if elem in ancestors:
+                    break
+                ancestors.add(elem)
+            continue
+        pending.extend((child, path + (element_title(child),))
+                for child in elem.findall('item', elem.nsmap))
+    return selected, ancestors
+
+
+def element_title(elem):
+    """Return the text of the <title> of an element, or None if it has none."""
+    title_elem = elem.find('title', elem.nsmap)
+    if title_elem is None:
+        return None
+    # title_elem.text has issues when there are BR tags. Instead get ALL text, ignoring BR tags.
+    # As BR tags do not make sense in metadata, we can assume it's an editor glitch causing it.
+    text = ''
+    for child in title_elem.iter():
+        if child.text:
+            text += child.text
+        if child.tail:
+            text += child.tail
+    return text.strip()
+
+
+def item_dict(root, metadata_sections=LOM_SECTIONS, stats=None):
+    """Return the dict of an <organization> or <item>, without its children."""
     root_dict = dict(root.items())
 
-    title_elem = root.find('title', root.nsmap)
-    if title_elem is not None:
-        # title_elem.text has issues when there are BR tags. Instead get ALL text, ignoring BR tags.
-        # As BR tags do not make sense in metadata, we can assume it's an editor glitch causing it.
-        text = ''
-        for child in title_elem.iter():
-            if child.text:
-                text += child.text
-            if child.tail:
-                text += child.tail
-        assert text.strip(), "Title element has no title: {}".format(etree.tostring(title_elem, pretty_print=True))
-        root_dict['title'] = text.strip()
+    title = element_title(root)
+    if title is not None:
+        assert title, "Title element has no title: {}".format(
+                etree.tostring(root.find('title', root.nsmap), pretty_print=True))
+        root_dict['title'] = title
 
+    if stats is not None:
+        stats.incr('items')
     metadata_elem = root.find('metadata', root.nsmap)
     if metadata_elem is not None:
-        root_dict['metadata'] = collect_metadata(metadata_elem)
+        if stats is None:
+            root_dict['metadata'] = collect_metadata(metadata_elem, metadata_sections)
+        else:
+            with stats.stage('collect_metadata'):
+                root_dict['metadata'] = collect_metadata(metadata_elem, metadata_sections)
 
-    children = []
-    for item in root.findall('item', root.nsmap):
-        children.append(walk_items(item))
+    return root_dict
 
-    if children:
-        root_dict['children'] = children
 
-    return root_dict
+def collect_metadata(metadata_elem, sections=LOM_SECTIONS):
+    """Return a dict of the LOM sections in a <metadata> element.
 
+    Each section is converted to the same dict xmltodict.parse would give for
+    it once namespace prefixes and <langstring> wrappers are stripped, but by
+    walking the lxml elements directly and without modifying them.
 
-def collect_metadata(metadata_elem):
-    strip_ns_prefix(metadata_elem)
-    strip_langstring(metadata_elem)
+    Args:
+        metadata_elem - <metadata> element.
+        sections (optional) - LOM sections to collect. Defaults to general,
+            rights, educational and lifecycle.
+    """
     metadata_dict = {}
 
-    for tag in ('general', 'rights', 'educational', 'lifecycle'):
-        elem = metadata_elem.find('lom/%s' % tag)
-        if elem:
-            metadata_dict.update(xmltodict.parse(etree.tostring(elem)))
+    for tag in sections:
+        elem = _find_lom_section(metadata_elem, tag)
+        # Sections without any child elements are skipped.
+        if elem is not None and any(not _is_element(child) or _localname(child) != 'langstring' for child in elem):
+            metadata_dict[tag] = lom_to_dict(elem, root=True)
 
     return metadata_dict
 
 
+def _find_lom_section(metadata_elem, tag):
+    for lom_elem in metadata_elem:
+        if _is_element(lom_elem) and _localname(lom_elem) == 'lom':
+            for elem in lom_elem:
+                if _is_element(elem) and _localname(elem) == tag:
+                    return elem
+    return None
+
+
+def lom_to_dict(elem, root=False):
+    """Convert a LOM element to the value xmltodict would give it.
+
+    Namespace prefixes are dropped from tag names, <langstring> elements are
+    replaced by their text, and namespace declarations become '@xmlns'
+    attributes (all in scope ones for the root element, new ones otherwise).
+    """
+    parent_nsmap = {} if root else elem.getparent().nsmap
+    return _lom_value(elem, elem.nsmap, parent_nsmap)
+
+
+def _lom_value(elem, nsmap, parent_nsmap):
+    value = _lom_attributes(elem, nsmap, parent_nsmap)
+    text = [elem.text or '']
+    for child in elem:
+        tag = child.tag
+        if not isinstance(tag, str):
+            # Comments and processing instructions are dropped, but text
+            # following them still belongs to this element.
+            text.append(child.tail or '')
+            continue
+        localname = tag.rpartition('}')[2]
+        if localname == 'langstring':
+            text.append((child.text or '') + (child.tail or ''))
+            continue
+        text.append(child.tail or '')
+        child_value = _lom_value(child, child.nsmap, nsmap)
+        if localname in value:
+            if isinstance(value[localname], list):
+                value[localname].append(child_value)
+            else:
+                value[localname] = [value[localname], child_value]
+        else:
+            value[localname] = child_value
+
+    data = ''.join(text).strip()
+    if not value:
+        return data or None
+    if data:
+        value['#text'] = data
+    return value
+
+
+def _lom_attributes(elem, nsmap, parent_nsmap):
+    attributes = {}
+    if nsmap != parent_nsmap:
+        for prefix, uri in nsmap.items():
+            if parent_nsmap.get(prefix) != uri:
+                attributes['@xmlns:%s' % prefix if prefix else '@xmlns'] = uri
+    for key, value in elem.items():
+        attributes['@%s' % _qualified_name(key, nsmap)] = value
+    return attributes
+
+
+def _qualified_name(key, nsmap):
+    if not key.startswith('{'):
+        return key
+    namespace, _, localname = key[1:].partition('}')
+    if namespace == 'http://www.w3.org/XML/1998/namespace':
+        return 'xml:%s' % localname
+    for prefix, uri in nsmap.items():
+        if prefix and uri == namespace:
+            return '%s:%s' % (prefix, localname)
+    return localname
+
+
+def _is_element(node):
+    return isinstance(node.tag, str)
+
+
+def _localname(elem):
+    return elem.tag.rpartition('}')[2]
+
+
 def strip_ns_prefix(tree):
     """Strip namespace prefixes from an LXML tree.
 
@@ -142,32 +654,191 @@ def strip_langstring(tree):
     etree.strip_elements(tree, 'langstring', with_tail=False)
 
 
-def collect_resources(license, item, resources_dict, ims_dir):
-    if item.get('children'):
-        for child in item['children']:
-            collect_resources(license, child, resources_dict, ims_dir)
-    elif item.get('identifierref'):
-        resource_elem = resources_dict[item['identifierref']]
+def collect_resources(license, item, resources_dict, ims_dir, graph=None):
+    if graph is None:
+        graph = ResourceGraph.from_elements(resources_dict)
 
-        # Add all resource attrs to item dict
-        for key, value in resource_elem.items():
-            key_stripped = re.sub('^{.*}', '', key) # Strip any namespace prefix
-            item[key_stripped] = value
+    pending = [item]
+    while pending:
+        item = pending.pop()
+        if item.get('children'):
+            pending.extend(reversed(item['children']))
+        elif item.get('identifierref'):
+            collect_resource(item, graph)
 
-        if resource_elem.get('type') == 'webcontent':
-            item['index_file'] = resource_elem.get('href')
-            item['files'] = derive_content_files_dict(
-                    resource_elem, resources_dict, ims_dir)
+
+def collect_resource(item, graph):
+    """Add the attributes and files of the resource of a leaf item to it.
+
+    The resource's identifier replaces the item's, which is kept as
+    'item_identifier' (see imscp.items.item_identifier).
+    """
+    resource = graph.resources.get(item['identifierref'])
+    if resource is None:
+        raise ValueError('Item %s refers to resource %s, which is not in the manifest' % (
+                item.get('identifier'), item['identifierref']))
+    if isinstance(item, Item):
+        item.set_resource(resource, graph)
+        return
+
+    # Add all resource attrs to item dict, keeping the item's own identifier.
+    if 'identifier' in item and 'identifier' in resource['attributes']:
+        item['item_identifier'] = item['identifier']
+    item.update(resource['attributes'])
+
+    if resource['attributes'].get('type') == 'webcontent':
+        item['index_file'] = resource['attributes'].get('href')
+        item['files'] = graph.files(item['identifierref'])
 
 
 def derive_content_files_dict(resource_elem, resources_dict, ims_dir):
+    """Return the paths of all files resource_elem needs, with its dependencies.
+
+    Resolves the whole dependency graph of resources_dict, so when resolving
+    many resources build a ResourceGraph once and use ResourceGraph.files.
+    """
+    graph = ResourceGraph.from_elements(resources_dict)
+    return graph.files(resource_elem.get('identifier'))
+
+
+def resource_record(resource_elem):
+    """Return the attributes, files and dependency ids of a <resource> element."""
     nsmap = resource_elem.nsmap
-    file_elements = resource_elem.findall('file', nsmap)
     base = "./" + (resource_elem.get('{http://www.w3.org/XML/1998/namespace}base') or "")
-    file_paths = [base + fe.get('href') for fe in file_elements]
-    dep_elements = resource_elem.findall('dependency', nsmap)
-    dep_res_elements = (resources_dict[de.get('identifierref')] for de in dep_elements)
-    dep_paths_list = (derive_content_files_dict(dre, resources_dict, ims_dir)
-            for dre in dep_res_elements)
-    dep_paths = list(itertools.chain(*dep_paths_list))  # Flatten
-    return file_paths + dep_paths
+    # Tuples and interned names and identifiers, as there is one of these per
+    # resource and they are kept for as long as the items referring to them.
+    attributes = {}
+    for key, value in resource_elem.items():
+        # Strip any namespace prefix
+        key = sys.intern(re.sub('^{.*}', '', key))
+        attributes[key] = value if key == 'href' else sys.intern(value)
+    return {
+        'attributes': attributes,
+        'files': tuple(base + fe.get('href') for fe in resource_elem.findall('file', nsmap)),
+        'dependencies': tuple(sys.intern(de.get('identifierref'))
+                for de in resource_elem.findall('dependency', nsmap)),
+    }
+
+
+class ResourceGraph(object):
+    """The <dependency> graph between the resources of a manifest.
+
+    The transitive file list of each resource is resolved once and memoized,
+    so resources shared by many items cost the same as any other. File paths
+    are deduplicated, keeping the order they are first referenced in.
+    Dependency cycles are resolved to the files of every resource in the
+    cycle and are reported in `cycles`.
+
+    Args:
+        resources - Dict of resource identifier -> resource_record dict.
+    """
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.cycles = []
+        self._files = {}
+
+    @property
+    def resolved(self):
+        """Number of resources whose file lists have been resolved so far."""
+        return len(self._files)
+
+    @classmethod
+    def from_elements(cls, resources_dict):
+        """Build a graph from a dict of identifier -> <resource> element."""
+        return cls(dict((sys.intern(identifier), resource_record(elem))
+                for identifier, elem in resources_dict.items()))
+
+    def files(self, identifier):
+        """Return the list of file paths resource identifier transitively needs.
+
+        The list is a new one every time, so callers can change it without
+        affecting the graph or other items using the same resource.
+        """
+        if identifier not in self._files:
+            self._resolve(identifier)
+        return list(self._files[identifier])
+
+    def _dependencies(self, identifier):
+        dependencies = []
+        for dep_id in self.resources[identifier]['dependencies']:
+            if dep_id in self.resources:
+                dependencies.append(dep_id)
+            else:
+                logging.warning('Resource %s depends on missing resource %s' % (identifier, dep_id))
+        return dependencies
+
+    def _resolve(self, root):
+        # Iterative Tarjan's algorithm, so deep dependency chains can't hit the
+        # recursion limit and every strongly connected component (i.e. cycle)
+        # is finished as a unit after all of its dependencies.
+        index = {}
+        lowlink = {}
+        dependencies = {}
+        stack = []
+        on_stack = set()
+        work = [(root, 0)]
+        while work:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = lowlink[node] = len(index)
+                stack.append(node)
+                on_stack.add(node)
+                dependencies[node] = self._dependencies(node)
+
+            deps = dependencies[node]
+            while i < len(deps):
+                dep = deps[i]
+                i += 1
+                if dep in self._files:
+                    continue
+                if dep not in index:
+                    work.append((node, i))
+                    work.append((dep, 0))
+                    break
+                if dep in on_stack:
+                    lowlink[node] = min(lowlink[node], index[dep])
+            else:
+                if lowlink[node] == index[node]:
+                    component = stack[stack.index(node):]
+                    del stack[stack.index(node):]
+                    on_stack.difference_update(component)
+                    self._finish(component, dependencies)
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+    def _finish(self, component, dependencies):
+        node = component[0]
+        if len(component) == 1 and node not in dependencies[node]:
+            paths = list(self.resources[node]['files'])
+            for dep in dependencies[node]:
+                paths.extend(self._files[dep])
+            self._files[node] = tuple(_dedupe(paths))
+            return
+
+        logging.warning('Dependency cycle between resources: %s' % ', '.join(component))
+        self.cycles.append(component)
+        members = set(component)
+        for node in component:
+            # Walk the cycle in the same order a plain recursive resolution
+            # would, visiting each resource once.
+            paths = []
+            visited = set()
+            pending = [node]
+            while pending:
+                current = pending.pop()
+                if current in visited:
+                    continue
+                visited.add(current)
+                if current in members:
+                    paths.extend(self.resources[current]['files'])
+                    pending.extend(reversed(dependencies[current]))
+                else:
+                    paths.extend(self._files[current])
+            self._files[node] = tuple(_dedupe(paths))
+
+
+def _dedupe(paths):
+    seen = set()
+    return [p for p in paths if not (p in seen or seen.add(p))]
@@ -0,0 +1,80 @@
+from imscp.items import item_identifier
+
+
+class ItemFilter(object):
+    """Selects the organizations and subtrees of a package to convert.
+
+    Pass one to extract_from_dir or make_topic_tree as item_filter. An item
+    is selected if its identifier is in identifiers or predicate returns
+    True for its path, and then its whole subtree is kept, along with the
+    topics above it. Other items are dropped without being converted or
+    having their resources resolved. Without identifiers or a predicate,
+    every item of the selected organizations is kept.
+
+    Args:
+        organizations (optional) - Identifiers of the organizations to
+            keep. Defaults to all of them.
+        identifiers (optional) - Identifiers of the items to keep. Leaves
+            also match by the identifier of their resource.
+        predicate (optional) - Called as predicate(path) for the
+            organization and every item not under a selected one, where
+            path is the tuple of titles from the organization's down to the
+            item's, e.g. ('Courses', 'Biology', 'Unit 3'). Return True to
+            keep the item.
+    """
+
+    def __init__(self, organizations=None, identifiers=None, predicate=None):
+        self.organizations = None if organizations is None else frozenset(organizations)
+        self.identifiers = None if identifiers is None else frozenset(identifiers)
+        self.predicate = predicate
+
+    def __repr__(self):
+        return 'ItemFilter(organizations=%r, identifiers=%r, predicate=%r)' % (
+                self.organizations, self.identifiers, self.predicate)
+
+    @property
+    def filters_items(self):
+        return self.identifiers is not None or self.predicate is not None
+
+    def accepts_organization(self, identifier):
+        return self.organizations is None or identifier in self.organizations
+
+    def selects(self, path, identifier, identifierref=None):
+        """Return whether the item at path (of titles) with identifier is selected."""
+        if self.identifiers is not None and (identifier in self.identifiers
+                or identifierref in self.identifiers):
+            return True
+        return self.predicate is not None and bool(self.predicate(path))
+
+
+def filter_tree(imscp_dict, item_filter):
+    """Return the selected part of an item tree, or None if nothing is selected.
+
+    imscp_dict is an organization (or any item) from extract_from_dir. The
+    selected items are returned as they are, and the topics above them are
+    copied with only the children that lead to selected items.
+    """
+    if not item_filter.filters_items:
+        return imscp_dict
+
+    # Walk the tree in post-order, so each topic is kept once all its
+    # children have been filtered.
+    kept = {}
+    pending = [(imscp_dict, (imscp_dict.get('title'),), False)]
+    while pending:
+        item, path, visited = pending.pop()
+        children = item.get('children') or []
+        if not visited:
+            if item_filter.selects(path, item_identifier(item), item.get('identifierref')):
+                kept[id(item)] = item
+                continue
+            pending.append((item, path, True))
+            pending.extend((child, path + (child.get('title'),), False)
+                    for child in reversed(children))
+            continue
+        kept_children = [kept[id(child)] for child in children if id(child) in kept]
+        if kept_children:
+            topic = dict(item)
+            topic['children'] = kept_children
+            kept[id(item)] = topic
+    return kept.get(id(imscp_dict))
@@ -0,0 +1,146 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+
+import imscp
+from imscp.items import item_identifier
+from imscp.package import open_package
+from imscp.ziputils import atomic_write
+
+
+STATUSES = ('added', 'changed', 'unchanged', 'removed')
+
+# One item of a plan: its key in the state file, fingerprint and status.
+PlannedItem = collections.namedtuple('PlannedItem', ['key', 'item', 'fingerprint', 'status'])
+
+
+class IncrementalState(object):
+    """Fingerprints of the items of a package, to only rebuild what changed.
+
+    Pass one to make_topic_tree as incremental. Items are keyed by the
+    identifiers of their <item>s (not of the resources of leaves, which
+    several leaves can share). Each item is fingerprinted
+    by its identifier, title and metadata, and leaves also by the checksums
+    of their resolved files. Leaves whose fingerprint is the same as in the
+    previous run reuse the HTML zip built then (so temp_dir must be a
+    directory that is kept between runs), and topics keep their source ids.
+    Call save() once every organization of the package has been converted.
+
+    Args:
+        path - Path of the JSON file to keep the state in. Loaded if it
+            exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.previous = {}
+        self.current = collections.OrderedDict()
+        self.counts = collections.Counter()
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('version') == imscp.__version__:
+                self.previous = state['items']
+            else:
+                logging.info('Ignoring incremental state %s from imscp %s' % (
+                        path, state.get('version')))
+
+    def __repr__(self):
+        return 'IncrementalState(%r)' % self.path
+
+    def plan(self, imscp_dict, ims_dir, options='', leaf_options=None):
+        """Fingerprint every item under imscp_dict and diff it with the previous run.
+
+        Return a list of PlannedItems in tree order.
+
+        Args:
+            imscp_dict - Dict of an organization (or any item) from
+                extract_from_dir.
+            ims_dir - Directory of IMSCP, or a ZipPackage.
+            options (optional) - String of the options zips are built with,
+                so that changing them rebuilds every leaf.
+            leaf_options (optional) - Dict of id(leaf dict) -> string of
+                options specific to that leaf.
+        """
+        package = open_package(ims_dir)
+        leaf_options = leaf_options or {}
+        planned = []
+        pending = [((), imscp_dict)]
+        while pending:
+            path, item = pending.pop()
+            key = '/'.join(path + (item_identifier(item) or '',))
+            is_leaf = not item.get('children')
+            fingerprint = fingerprint_item(item, package if is_leaf else None,
+                    options + leaf_options.get(id(item), '') if is_leaf else '')
+            previous = self.previous.get(key)
+            if previous is None:
+                status = 'added'
+            elif previous['fingerprint'] == fingerprint:
+                status = 'unchanged'
+            else:
+                status = 'changed'
+            planned.append(PlannedItem(key, item, fingerprint, status))
+            if not is_leaf:
+                children = item['children']
+                for position, child in reversed(list(enumerate(children))):
+                    child_path = path + (item_identifier(item) or '',)
+                    if not item_identifier(child):
+                        # Unidentified items are keyed by their position.
+                        child_path += ('#%d' % position,)
+                    pending.append((child_path, child))
+        return planned
+
+    def reusable(self, planned_item):
+        """Return the previous entry of an unchanged item, or None."""
+        if planned_item.status != 'unchanged':
+            return None
+        return self.previous[planned_item.key]
+
+    def record(self, planned, zip_paths, source_ids):
+        """Record the planned items as converted, with their zips and source ids."""
+        for planned_item in planned:
+            entry = {'fingerprint': planned_item.fingerprint}
+            zip_path = zip_paths.get(id(planned_item.item))
+            if zip_path is not None:
+                entry['zip_path'] = zip_path
+            source_id = source_ids.get(id(planned_item.item))
+            if source_id is not None:
+                entry['source_id'] = source_id
+            if planned_item.key not in self.current:
+                self.counts[planned_item.status] += 1
+            self.current[planned_item.key] = entry
+
+    def removed(self):
+        """Return the keys of previous items not seen in this run."""
+        return [key for key in self.previous if key not in self.current]
+
+    def report(self):
+        """Return counts of added, changed, unchanged and removed items."""
+        report = collections.OrderedDict((status, self.counts[status]) for status in STATUSES)
+        report['removed'] = len(self.removed())
+        return report
+
+    def save(self):
+        """Write the items of this run to the state file."""
+        state = {'version': imscp.__version__, 'items': self.current}
+        with atomic_write(self.path, 'w') as f:
+            json.dump(state, f, indent=1)
+
+
+def fingerprint_item(item, package=None, options=''):
+    """Return a fingerprint of an item dict from extract_from_dir.
+
+    Covers the item's identifier, title and metadata, and, if a package is
+    given, its index file and resolved files and their checksums. Children
+    aren't included.
+    """
+    digest = hashlib.sha256()
+    summary = dict((key, value) for key, value in item.items() if key != 'children')
+    digest.update(json.dumps(summary, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(options.encode('utf-8') + b'\0')
+    if package is not None and item.get('index_file'):
+        for href in [item['index_file']] + item.get('files', []):
+            digest.update(('%s=%s\0' % (href, package.checksum(href))).encode('utf-8'))
+    return digest.hexdigest()
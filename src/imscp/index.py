@@ -0,0 +1,170 @@
+import collections
+
+from imscp.package import app_files, member_name, open_package
+from imscp.stats import NULL_STATS
+
+
+# Sizes of one item: for a leaf, those of the files of its HTML app, and for
+# a topic, the sums over the leaves under it.
+IndexEntry = collections.namedtuple('IndexEntry', ['item', 'path', 'leaves', 'files',
+        'size', 'compress_size', 'missing'])
+
+
+class PackageIndex(object):
+    """Sizes and missing files of every item of a package, before converting it.
+
+    Built only from the manifest dict and the sizes of the package's files
+    (for a ZipPackage, from the zip's central directory), so nothing is
+    extracted or decompressed. For each webcontent leaf, the files of its
+    HTML app are resolved as they would be zipped (see
+    imscp.package.app_files), giving the app's size, the compressed size of
+    its files in the package (about the size of the HTML zip built from
+    them) and the hrefs it refers to that aren't in the package, which would
+    otherwise only fail once its zip is built. Topics get the sums of the
+    leaves under them.
+
+    Args:
+        imscp_dict - Dict of an organization (or any item) from
+            extract_from_dir, or its Item.
+        ims_dir - Directory of IMSCP, or a ZipPackage.
+        stats (imscp.stats.PipelineStats, optional) - Stats to time indexing in.
+    """
+
+    def __init__(self, imscp_dict, ims_dir, stats=None):
+        stats = stats or NULL_STATS
+        self.package = open_package(ims_dir)
+        self.entries = collections.OrderedDict()
+        self._file_sizes = {}
+        with stats.stage('index_package'):
+            self._index(imscp_dict)
+
+    def __repr__(self):
+        return 'PackageIndex(%r)' % self.package
+
+    def _index(self, imscp_dict):
+        # Leaves are sized in tree order, and topics summed up once all the
+        # items under them are.
+        order = []
+        pending = [(imscp_dict, (imscp_dict.get('title'),))]
+        while pending:
+            item, path = pending.pop()
+            order.append((item, path))
+            children = item.get('children') or []
+            pending.extend((child, path + (child.get('title'),)) for child in reversed(children))
+        entries = {}
+        for item, path in reversed(order):
+            children = item.get('children')
+            if children:
+                child_entries = [entries[id(child)] for child in children]
+                missing = collections.OrderedDict.fromkeys(
+                        href for entry in child_entries for href in entry.missing)
+                entries[id(item)] = IndexEntry(item, path,
+                        sum(entry.leaves for entry in child_entries),
+                        sum(entry.files for entry in child_entries),
+                        sum(entry.size for entry in child_entries),
+                        sum(entry.compress_size for entry in child_entries),
+                        tuple(missing))
+            else:
+                entries[id(item)] = self._leaf_entry(item, path)
+        for item, path in order:
+            self.entries[id(item)] = entries[id(item)]
+
+    def _leaf_entry(self, item, path):
+        if item.get('type') != 'webcontent' or not item.get('index_file'):
+            return IndexEntry(item, path, 1, 0, 0, 0, ())
+        size = compress_size = 0
+        hrefs = app_files(item).values()
+        for href in hrefs:
+            sizes = self._sizes(href)
+            if sizes is not None:
+                size += sizes[0]
+                compress_size += sizes[1]
+        # Files replaced by another one with the same name aren't zipped, but
+        # are still reported if they are missing.
+        missing = collections.OrderedDict()
+        for href in [item['index_file']] + list(item['files']):
+            if self._sizes(href) is None:
+                missing.setdefault(member_name(href), href)
+        return IndexEntry(item, path, 1, len(hrefs), size, compress_size,
+                tuple(missing.values()))
+
+    def _sizes(self, href):
+        name = member_name(href)
+        try:
+            return self._file_sizes[name]
+        except KeyError:
+            sizes = self._file_sizes[name] = self.package.sizes(href)
+            return sizes
+
+    def __getitem__(self, item):
+        """Return the IndexEntry of an item dict of the indexed tree."""
+        return self.entries[id(item)]
+
+    def __iter__(self):
+        """Iterate over the IndexEntries of every item, in tree order."""
+        return iter(self.entries.values())
+
+    def leaves(self):
+        """Return the IndexEntries of the leaves, in tree order."""
+        return [entry for entry in self if not entry.item.get('children')]
+
+    def missing(self):
+        """Return the IndexEntries of the leaves that refer to missing files."""
+        return [entry for entry in self.leaves() if entry.missing]
+
+    def oversized(self, max_size):
+        """Return the IndexEntries of the leaves whose app is over max_size bytes."""
+        return [entry for entry in self.leaves() if entry.size > max_size]
+
+    def check(self, max_size=None):
+        """Raise ValueError if a leaf refers to missing files or its app is over max_size bytes."""
+        problems = ['%s: missing %s' % (' / '.join(map(str, entry.path)), ', '.join(entry.missing))
+                for entry in self.missing()]
+        if max_size is not None:
+            problems.extend('%s: %d bytes, over %d' % (' / '.join(map(str, entry.path)),
+                    entry.size, max_size) for entry in self.oversized(max_size))
+        if problems:
+            raise ValueError('Package %s has %d problems:\n%s' % (
+                    self.package, len(problems), '\n'.join(problems)))
+
+    def report(self):
+        """Return the totals of the package.
+
+        size and compress_size are summed over apps, so files used by several
+        apps count once per app, and unique_size and unique_compress_size
+        count them once.
+        """
+        leaves = self.leaves()
+        found = [sizes for sizes in self._file_sizes.values() if sizes is not None]
+        return collections.OrderedDict([
+            ('items', len(self.entries)),
+            ('leaves', len(leaves)),
+            ('files', len(self._file_sizes)),
+            ('size', sum(entry.size for entry in leaves)),
+            ('compress_size', sum(entry.compress_size for entry in leaves)),
+            ('unique_size', sum(sizes[0] for sizes in found)),
+            ('unique_compress_size', sum(sizes[1] for sizes in found)),
+            ('missing_files', len(self._file_sizes) - len(found)),
+            ('leaves_missing_files', sum(1 for entry in leaves if entry.missing)),
+            ('largest_size', max([entry.size for entry in leaves] or [0])),
+        ])
+
+
+def leaf_sizes(leaves, ims_dir):
+    """Return the size in bytes of the HTML app of each webcontent leaf dict.
+
+    Sizes are read like PackageIndex's, and missing files count as empty.
+    """
+    package = open_package(ims_dir)
+    file_sizes = {}
+    sizes = []
+    for leaf in leaves:
+        size = 0
+        if leaf.get('index_file'):
+            for href in app_files(leaf).values():
+                name = member_name(href)
+                if name not in file_sizes:
+                    file_sizes[name] = (package.sizes(href) or (0, 0))[0]
+                size += file_sizes[name]
+        sizes.append(size)
+    return sizes
@@ -0,0 +1,168 @@
+import collections.abc
+import sys
+
+
+# Interned key tuples, shared by every item with the same keys in the same
+# order (typically all the leaves, and all the topics, of a package).
+_LAYOUTS = {}
+
+
+def _layout(keys):
+    keys = tuple(keys)
+    layout = _LAYOUTS.get(keys)
+    if layout is None:
+        layout = _LAYOUTS[keys] = tuple(sys.intern(key) for key in keys)
+    return layout
+
+
+def item_identifier(item):
+    """Return the identifier of the manifest <item> of an item dict or Item.
+
+    Collecting a leaf's resource replaces its 'identifier' with the
+    resource's, and keeps the item's own as 'item_identifier'.
+    """
+    return item.get('item_identifier', item.get('identifier'))
+
+
+class Item(collections.abc.MutableMapping):
+    """A compact <organization> or <item>, with a dict view of it.
+
+    Reads and writes like the item dicts extract_from_dir returns, with the
+    same keys in the same order, but stores them as a tuple of values and a
+    tuple of keys shared with every item with the same keys. The attributes
+    and files of a leaf's resource aren't copied into it: it refers to the
+    resource by its identifierref in the ResourceGraph, where the record is
+    shared by every leaf using that resource, and the file list is resolved
+    (once per resource) when it is read.
+
+    Pickles (e.g. to worker processes) as a plain dict. Use to_dict() to get
+    plain dicts of a whole tree, e.g. to serialize it.
+
+    Args:
+        fields - Dict of the item's own attributes, title and metadata.
+    """
+
+    __slots__ = ('_keys', '_values', 'children', 'graph')
+
+    def __init__(self, fields):
+        self._keys = _layout(fields)
+        # Identifiers and flags are interned; most are the same as those of
+        # other items or resources.
+        self._values = tuple(sys.intern(value) if isinstance(value, str) and key != 'title' else value
+                for key, value in fields.items())
+        self.children = None
+        self.graph = None
+
+    def __repr__(self):
+        return 'Item(%r)' % self.get('identifier')
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def set_resource(self, resource, graph):
+        """Refer the item to its resource record in graph."""
+        self.graph = graph
+        attributes = resource['attributes']
+        if 'identifier' in self._keys and 'identifier' in attributes:
+            self['item_identifier'] = self['identifier']
+        # The resource's attributes replace the item's, like dict.update
+        # (which keeps their position).
+        if any(key in attributes for key in self._keys):
+            self._values = tuple(attributes.get(key, value)
+                    for key, value in zip(self._keys, self._values))
+
+    def _resource(self):
+        if self.graph is None:
+            return None
+        return self.graph.resources[self._values[self._keys.index('identifierref')]]
+
+    def _resource_keys(self):
+        resource = self._resource()
+        if resource is None:
+            return ()
+        keys = list(resource['attributes'])
+        if resource['attributes'].get('type') == 'webcontent':
+            keys.extend(('index_file', 'files'))
+        return keys
+
+    def __getitem__(self, key):
+        if key in self._keys:
+            return self._values[self._keys.index(key)]
+        if key == 'children':
+            if self.children:
+                return self.children
+            raise KeyError(key)
+        resource = self._resource()
+        if resource is not None:
+            attributes = resource['attributes']
+            if key in attributes:
+                return attributes[key]
+            if attributes.get('type') == 'webcontent':
+                if key == 'index_file':
+                    return attributes.get('href')
+                if key == 'files':
+                    return self.graph.files(self['identifierref'])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'children':
+            self.children = value
+        elif key in self._keys:
+            index = self._keys.index(key)
+            self._values = self._values[:index] + (value,) + self._values[index + 1:]
+        else:
+            self._keys = _layout(self._keys + (key,))
+            self._values += (value,)
+
+    def __delitem__(self, key):
+        if key in self._keys:
+            index = self._keys.index(key)
+            self._keys = _layout(self._keys[:index] + self._keys[index + 1:])
+            self._values = self._values[:index] + self._values[index + 1:]
+        elif key == 'children' and self.children:
+            self.children = None
+        else:
+            # Resource attributes are shared with other items.
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self._keys:
+            yield key
+        if self.children:
+            yield 'children'
+        for key in self._resource_keys():
+            if key not in self._keys:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @classmethod
+    def from_dict(cls, item_dict):
+        """Return an Item tree of an item dict and all its descendants.
+
+        The items keep the resource attributes and files of the dicts as
+        their own, rather than referring to a ResourceGraph.
+        """
+        def make_item(item_dict):
+            return cls(dict((key, value) for key, value in item_dict.items() if key != 'children'))
+        root = make_item(item_dict)
+        pending = [(item_dict, root)]
+        while pending:
+            item_dict, item = pending.pop()
+            if item_dict.get('children'):
+                children = [(child, make_item(child)) for child in item_dict['children']]
+                item.children = [child_item for _, child_item in children]
+                pending.extend(children)
+        return root
+
+    def to_dict(self):
+        """Return the item and all its descendants as plain dicts."""
+        root = dict(self)
+        pending = [root]
+        while pending:
+            item = pending.pop()
+            if item.get('children'):
+                item['children'] = [dict(child) for child in item['children']]
+                pending.extend(item['children'])
+        return root
@@ -0,0 +1,253 @@
+import collections
+import functools
+import hashlib
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+
+from imscp.ziputils import ZipMember, atomic_write
+
+
+def open_package(ims_dir):
+    """Return a package object for ims_dir.
+
+    Args:
+        ims_dir - Path of directory of an extracted IMSCP, or a package object
+            (DirPackage or ZipPackage), which is returned unchanged.
+    """
+    if isinstance(ims_dir, (DirPackage, ZipPackage)):
+        return ims_dir
+    return DirPackage(ims_dir)
+
+
+# Packages refer to the same few dependency files from most of their leaves.
+@functools.lru_cache(maxsize=65536)
+def member_name(href):
+    """Normalize a manifest href into the name of a file in the package.
+
+    Strips any query string or fragment, './' prefixes and Windows separators,
+    e.g. './content/page.html?x=1#top' -> 'content/page.html'
+    """
+    name = href.split('?')[0].split('#')[0].replace('\\', '/')
+    name = posixpath.normpath(name).lstrip('/')
+    return '' if name == '.' else name
+
+
+def app_files(content_dict):
+    """Return the files of the HTML app of a webcontent leaf, as laid out in its zip.
+
+    Return an ordered dict of path in zip -> href. The index file becomes
+    index.html and every other file is flattened to its base name; like
+    copying them into one directory in order, later files replace earlier
+    ones with the same name.
+    """
+    files = collections.OrderedDict()
+    files['index.html'] = content_dict['index_file']
+    for href in content_dict['files']:
+        name = posixpath.basename(member_name(href))
+        files.pop(name, None)
+        files[name] = href
+    return files
+
+
+class DirPackage(object):
+    """An IMS Content Package that has already been extracted to a directory."""
+
+    def __init__(self, ims_dir):
+        self.root = ims_dir
+
+    def __repr__(self):
+        return 'DirPackage(%r)' % self.root
+
+    def path(self, href):
+        """Return the local path of the file at href."""
+        return os.path.join(self.root, href)
+
+    def open(self, href):
+        return open(self.path(href), 'rb')
+
+    def exists(self, href):
+        return os.path.isfile(self.path(href))
+
+    def checksum(self, href):
+        """Return a string that changes whenever the content of href does.
+
+        The MD5 of the file, or None if it doesn't exist.
+        """
+        digest = hashlib.md5()
+        try:
+            with self.open(href) as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        return digest.hexdigest()
+
+    def sizes(self, href):
+        """Return (size, size) of the file at href, or None if it doesn't exist.
+
+        Files on disk aren't compressed, so both sizes are the same.
+        """
+        path = self.path(href)
+        if not os.path.isfile(path):
+            return None
+        size = os.path.getsize(path)
+        return size, size
+
+    def source(self, href):
+        """Return the content of href as an imscp.ziputils entry (its path)."""
+        path = self.path(href)
+        if not os.path.isfile(path):
+            raise FileNotFoundError('%s not found in %s' % (href, self.root))
+        return path
+
+    def extract_all(self):
+        return self.root
+
+
+class ZipPackage(object):
+    """An IMS Content Package read directly from its zip file.
+
+    imsmanifest.xml and any other member can be read from the archive in
+    memory. Member files are only written to disk when extract() is called
+    for them, so parsing a package never pays for extracting its media.
+
+    Args:
+        zip_file_path - Path to IMSCP zip file.
+        extract_path (optional) - Path of directory to extract members to. If
+            not given, a temporary one will be created (but not cleaned up).
+    """
+
+    def __init__(self, zip_file_path, extract_path=None):
+        self.zip_file_path = zip_file_path
+        self.root = extract_path or tempfile.mkdtemp()
+        self._zip = None
+        self._members = None
+        self._extracted = set()
+        self._extracted_all = False
+
+    def __repr__(self):
+        return 'ZipPackage(%r, %r)' % (self.zip_file_path, self.root)
+
+    def __getstate__(self):
+        # Open zip files can't be pickled; worker processes reopen the archive.
+        state = self.__dict__.copy()
+        state['_zip'] = None
+        state['_members'] = None
+        return state
+
+    @property
+    def zip_file(self):
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self.zip_file_path)
+        return self._zip
+
+    @property
+    def members(self):
+        """Dict of normalized member name -> ZipInfo for every file in the zip."""
+        if self._members is None:
+            self._members = dict(
+                (member_name(info.filename), info)
+                for info in self.zip_file.infolist() if not info.is_dir())
+        return self._members
+
+    def getinfo(self, href):
+        return self.members.get(member_name(href))
+
+    def path(self, href):
+        """Return the local path href is (or will be) extracted to."""
+        return os.path.join(self.root, *member_name(href).split('/'))
+
+    def open(self, href):
+        info = self.getinfo(href)
+        if info is None:
+            raise FileNotFoundError(
+                '%s not found in %s' % (href, self.zip_file_path))
+        return self.zip_file.open(info)
+
+    def exists(self, href):
+        return self.getinfo(href) is not None
+
+    def checksum(self, href):
+        """Return a string that changes whenever the content of href does.
+
+        Made of the CRC-32 and size in the zip's central directory, so
+        nothing needs to be read or decompressed. That is weaker than
+        DirPackage's MD5: a changed member of the same size keeps its
+        checksum about once in 2**32 changes. None if it doesn't exist.
+        """
+        info = self.getinfo(href)
+        if info is None:
+            return None
+        return '%08x-%d' % (info.CRC, info.file_size)
+
+    def sizes(self, href):
+        """Return (size, compressed size) of the member at href, or None if it doesn't exist.
+
+        Read from the zip's central directory, so nothing is decompressed.
+        """
+        info = self.getinfo(href)
+        if info is None:
+            return None
+        return info.file_size, info.compress_size
+
+    def source(self, href):
+        """Return the member at href as an imscp.ziputils entry, a ZipMember.
+
+        It is read straight from the zip, so it needn't be extracted.
+        """
+        info = self.getinfo(href)
+        if info is None:
+            raise FileNotFoundError(
+                '%s not found in %s' % (href, self.zip_file_path))
+        return ZipMember(self.zip_file, info)
+
+    def extract(self, hrefs, stats=None):
+        """Extract the members at hrefs, skipping any already on disk.
+
+        Used by extract_from_zip to extract only the files of the items an
+        ItemFilter selected.
+
+        Returns the directory the members were extracted to.
+
+        Args:
+            hrefs - Manifest hrefs of the members to extract.
+            stats (imscp.stats.PipelineStats, optional) - Stats to count
+                extracted files and bytes into.
+        """
+        for href in hrefs:
+            name = member_name(href)
+            if self._extracted_all or name in self._extracted:
+                continue
+            info = self.members.get(name)
+            if info is None:
+                logging.warning('%s not found in %s' % (href, self.zip_file_path))
+                continue
+            if self._extract_member(name, info) and stats is not None:
+                stats.incr('files_extracted')
+                stats.incr('bytes_extracted', info.file_size)
+            self._extracted.add(name)
+        return self.root
+
+    def extract_all(self):
+        if not self._extracted_all:
+            logging.info('Extracting zip file %s to %s' % (self.zip_file_path, self.root))
+            self.zip_file.extractall(self.root)
+            self._extracted_all = True
+        return self.root
+
+    def _extract_member(self, name, info):
+        if name.startswith('../'):
+            raise ValueError('Refusing to extract %s outside of %s' % (name, self.root))
+        dest_path = self.path(name)
+        if os.path.exists(dest_path):
+            return False
+        dest_dir = os.path.dirname(dest_path)
+        os.makedirs(dest_dir, exist_ok=True)
+        # Several workers can extract the same shared member.
+        with self.zip_file.open(info) as src, atomic_write(dest_path) as dest:
+            shutil.copyfileobj(src, dest)
+        return True
@@ -1,20 +1,28 @@
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from distutils.dir_util import copy_tree
 import hashlib
 import logging
 import os
 import pathlib
-import shutil
 import tempfile
 import uuid
 
-from bs4 import BeautifulSoup
-
 from le_utils.constants import format_presets
 
 from ricecooker.classes import nodes, files, licenses
-from ricecooker.utils.zip import create_predictable_zip
 from ricecooker.utils.browser import preview_in_browser
 
+from imscp.filters import filter_tree
+from imscp.index import leaf_sizes
+from imscp.package import app_files, member_name, open_package
+from imscp.scorm import (inject_scorm_scripts, scorm_assets,
+        scorm_dependency_url, scorm_dependency_zip)
+from imscp.stats import NULL_STATS, PipelineStats
+from imscp.shared import REWRITE_EXTENSIONS, rewrite_references
+from imscp.ziputils import (entry_size, predictable_zip_bytes, read_entry,
+        save_predictable_zip, save_zip_bytes)
+
 
 ENTRYPOINT_TEMPLATE = """
 <!DOCTYPE html>
@@ -30,7 +38,9 @@ ENTRYPOINT_TEMPLATE = """
 
 
 def make_topic_tree(license, imscp_dict, ims_dir, scraper_class=None,
-        temp_dir=None):
+        temp_dir=None, jobs=None, use_threads=False, cache=None, stats=None,
+        shared_assets=None, incremental=None, scrape_session=None,
+        item_filter=None, compression=None, index=None):
     """Return a TopicTree node from a dict of some subset of an IMSCP manifest.
 
     Ready to be uploaded via Ricecooker to Studio or used in Kolibri.
@@ -38,33 +48,234 @@ def make_topic_tree(license, imscp_dict, ims_dir, scraper_class=None,
     Args:
         license - License to apply to content nodes.
         imscp_dict - Dict of IMSCP from extract_from_zip or extract_from_dir.
-        ims_dir (string) - Path of directory of IMSCP
+        ims_dir (string or ZipPackage) - Path of directory of IMSCP, or a
+            ZipPackage to extract each app's files from the zip as needed.
         scraper_class (webmixer.HTMLPageScraper class, optional):
             Webmixer scraper class to use for pruning an HTML page.
         temp_dir (string, optional) - Full path of temporary directory to
             output HTML zip files to.
+        jobs (int, optional) - Number of workers to build HTML zip files in
+            parallel. The tree is the same as when building them one by one.
+        use_threads (bool, optional) - Use a thread pool instead of a process
+            pool for the jobs workers.
+        cache (imscp.cache.ZipCache, optional) - Cache to reuse HTML zip
+            files from, and to add newly built ones to. It is trimmed to
+            its max_size once the tree is built, keeping the zips of the
+            tree's nodes.
+        stats (imscp.stats.PipelineStats, optional) - Stats to record stage
+            timings and counters into.
+        shared_assets (imscp.shared.SharedAssets, optional) - Move files
+            shared by many HTML apps to HTML5 dependency zips instead of
+            copying them into each app. Not used with a scraper_class.
+        incremental (imscp.incremental.IncrementalState, optional) - Only
+            build the HTML zips of leaves that were added or changed since
+            the previous run, reusing the previous zips of the others.
+        scrape_session (imscp.scraping.ScrapeSession, optional) - Scrape the
+            pages with scraper_class concurrently in the session's threads,
+            reading the assets they share only once. Reuse the same session
+            for every organization of a package.
+        item_filter (imscp.filters.ItemFilter, optional) - Only convert the
+            items its identifiers or predicate select, and the topics above
+            them. Return None if there are none. Its organizations are
+            ignored here; filter those when extracting.
+        compression (imscp.compression.CompressionPolicy, optional) - How to
+            compress the members of the HTML zips (and shared dependency
+            zips). By default every member is deflated.
+        index (imscp.index.PackageIndex, optional) - Index of imscp_dict,
+            e.g. the one it was checked with, to schedule the largest zips
+            first when building them in parallel.
     """
+    stats = stats or NULL_STATS
+    if item_filter is not None:
+        imscp_dict = filter_tree(imscp_dict, item_filter)
+        if imscp_dict is None:
+            return None
+    with stats.stage('make_topic_tree'):
+        shared = {}
+        if shared_assets is not None and not scraper_class:
+            leaves = [leaf for leaf in iter_leaves(imscp_dict)
+                    if leaf['type'] == 'webcontent']
+            shared = dict(zip(map(id, leaves), shared_assets.build(
+                    leaves, ims_dir, temp_dir=temp_dir, stats=stats,
+                    compression=compression)))
+
+        zip_paths = {}
+        source_ids = {}
+        if incremental is not None:
+            with stats.stage('fingerprint'):
+                planned = incremental.plan(imscp_dict, ims_dir,
+                        options=_scraper_name(scraper_class) + _policy_name(compression),
+                        leaf_options=dict((leaf_id, repr(sorted(files.items())))
+                            for leaf_id, (files, _) in shared.items()))
+            for planned_item in planned:
+                previous = incremental.reusable(planned_item)
+                stats.incr('items_%s' % planned_item.status)
+                if previous is None:
+                    continue
+                if 'source_id' in previous:
+                    source_ids[id(planned_item.item)] = previous['source_id']
+                if os.path.exists(previous.get('zip_path') or ''):
+                    zip_paths[id(planned_item.item)] = previous['zip_path']
+
+        if scraper_class and scrape_session is not None:
+            zip_paths.update(build_html5_zips(imscp_dict, ims_dir,
+                    scraper_class=scraper_class, temp_dir=temp_dir,
+                    jobs=scrape_session.jobs, use_threads=True, cache=cache,
+                    stats=stats, skip=zip_paths, scrape_session=scrape_session,
+                    compression=compression, index=index))
+        elif jobs and jobs > 1:
+            zip_paths.update(build_html5_zips(imscp_dict, ims_dir,
+                    scraper_class=scraper_class, temp_dir=temp_dir, jobs=jobs,
+                    use_threads=use_threads, cache=cache, stats=stats,
+                    shared=shared, skip=zip_paths, compression=compression,
+                    index=index))
+        topic_tree = _make_topic_tree(license, imscp_dict, ims_dir,
+                scraper_class, temp_dir, zip_paths, cache, stats, shared,
+                source_ids, compression)
+        if incremental is not None:
+            incremental.record(planned, zip_paths, source_ids)
+        if cache is not None:
+            # Only evict once every node has its zip, and never those zips
+            # (worker processes pinned the ones they built in their own copy
+            # of the cache).
+            for zip_path in zip_paths.values():
+                cache.pin(zip_path)
+            with stats.stage('cache_trim'):
+                cache.trim()
+        return topic_tree
+
+
+def _scraper_name(scraper_class):
+    if not scraper_class:
+        return ''
+    return '%s.%s' % (scraper_class.__module__, scraper_class.__qualname__)
+
+
+def _policy_name(compression):
+    return '' if compression is None else repr(compression)
+
+
+def _make_topic_tree(license, imscp_dict, ims_dir, scraper_class, temp_dir,
+        zip_paths, cache, stats, shared, source_ids, compression):
+    # zip_paths (id(leaf) -> zip path) holds the zips that are already
+    # built; the ones built here are added to it.
     if imscp_dict.get('children'):
         topic_node = nodes.TopicNode(
-            source_id=str(uuid.uuid4()),
+            source_id=source_ids.setdefault(id(imscp_dict), str(uuid.uuid4())),
             title=imscp_dict['title']
         )
+        stats.incr('topic_nodes')
         for child in imscp_dict['children']:
-            topic_node.add_child(make_topic_tree(
-                    license, child, ims_dir, scraper_class=scraper_class,
-                    temp_dir=temp_dir))
+            topic_node.add_child(_make_topic_tree(
+                    license, child, ims_dir, scraper_class, temp_dir,
+                    zip_paths, cache, stats, shared, source_ids, compression))
         return topic_node
     else:
         if imscp_dict['type'] == 'webcontent':
-            return create_html5_app_node(license, imscp_dict, ims_dir,
-                    scraper_class=scraper_class, temp_dir=temp_dir)
+            shared_files, dependency_zips = shared.get(id(imscp_dict), (None, ()))
+            if id(imscp_dict) in zip_paths:
+                stats.incr('html5_nodes')
+                return html5_app_node(license, imscp_dict,
+                        zip_paths[id(imscp_dict)], dependency_zips)
+            node = create_html5_app_node(license, imscp_dict, ims_dir,
+                    scraper_class=scraper_class, temp_dir=temp_dir,
+                    cache=cache, stats=stats, shared_files=shared_files,
+                    dependency_zips=dependency_zips, compression=compression)
+            zip_paths[id(imscp_dict)] = node.files[0].path
+            return node
         else:
             logging.warning(
                     'Content type %s not supported yet.' % imscp_dict['type'])
 
 
+def build_html5_zips(imscp_dict, ims_dir, scraper_class=None, temp_dir=None,
+        jobs=None, use_threads=False, cache=None, stats=None, shared=None,
+        skip=(), scrape_session=None, compression=None, index=None):
+    """Build the HTML zip file of every webcontent leaf under imscp_dict.
+
+    Return a dict of id(leaf dict) -> zip path.
+
+    Args:
+        jobs (int, optional) - Number of worker processes (or threads) to
+            build zips in. Defaults to the number of CPUs.
+        shared (dict, optional) - Dict of id(leaf dict) -> (shared_files,
+            dependency zips) from imscp.shared.SharedAssets.build.
+        skip (optional) - ids of leaf dicts not to build zips for.
+        index (imscp.index.PackageIndex, optional) - Index of the package
+            to read the sizes of leaves from. Zips are built largest first,
+            so that a big app doesn't start last and hold up the whole
+            build; without an index, the sizes are read from the package.
+        scrape_session (imscp.scraping.ScrapeSession, optional) - Session to
+            scrape pages with; needs use_threads.
+        See make_topic_tree for the other args.
+
+    With a scraper_class, a ZipPackage is extracted once before any page is
+    scraped, and leaves with the same index page (e.g. index.html#ch1 and
+    index.html#ch2) share one zip, which is only built once.
+    """
+    stats = stats or NULL_STATS
+    shared = shared or {}
+    leaves = [leaf for leaf in iter_leaves(imscp_dict)
+            if leaf['type'] == 'webcontent' and id(leaf) not in skip]
+    if scraper_class:
+        # Webmixer follows links from the pages, so it needs every file on
+        # disk; workers get the package already extracted, instead of all
+        # extracting it over each other.
+        with stats.stage('extract_zip'):
+            open_package(ims_dir).extract_all()
+        groups = collections.OrderedDict()
+        for leaf in leaves:
+            groups.setdefault(member_name(leaf['index_file']), []).append(leaf)
+        groups = list(groups.values())
+    else:
+        groups = [[leaf] for leaf in leaves]
+    if index is not None:
+        sizes = [index[group[0]].size for group in groups]
+    else:
+        sizes = leaf_sizes([group[0] for group in groups], ims_dir)
+    # Largest first; sorted is stable, so equal sizes stay in tree order.
+    order = sorted(range(len(groups)), key=lambda i: -sizes[i])
+    executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    zip_paths = {}
+    with stats.stage('build_html5_zips'), executor_class(max_workers=jobs) as executor:
+        futures = dict((i, executor.submit(_build_html5_zip_job, groups[i][0], ims_dir,
+                stats is not NULL_STATS, scraper_class=scraper_class,
+                temp_dir=temp_dir, cache=cache,
+                shared_files=shared.get(id(groups[i][0]), (None, ()))[0],
+                scrape_session=scrape_session, compression=compression))
+                for i in order)
+        # Results are still collected in tree order.
+        for i, group in enumerate(groups):
+            zip_path, report = futures[i].result()
+            if report is not None:
+                stats.merge(report)
+            for leaf in group:
+                zip_paths[id(leaf)] = zip_path
+    return zip_paths
+
+
+def _build_html5_zip_job(content_dict, ims_dir, record_stats, **kwargs):
+    # Workers record into their own stats, whose report is merged back by
+    # build_html5_zips; that works the same for processes and threads.
+    stats = PipelineStats() if record_stats else None
+    zip_path = build_html5_zip(content_dict, ims_dir, stats=stats, **kwargs)
+    return zip_path, stats.report() if stats else None
+
+
+def iter_leaves(imscp_dict):
+    """Yield the leaf item dicts of imscp_dict in tree order."""
+    pending = [imscp_dict]
+    while pending:
+        item = pending.pop()
+        if item.get('children'):
+            pending.extend(reversed(item['children']))
+        else:
+            yield item
+
+
 def make_topic_tree_with_entrypoints(license, imscp_zip, imscp_dict, ims_dir,
-        temp_dir=None, parent_id=None, node_options=None):
+        temp_dir=None, parent_id=None, node_options=None, stats=None,
+        compression=None):
     """Return a TopicTree node from a dict of some subset of an IMSCP manifest.
 
     The actual IMSCP zip is marked as a dependency, and the zip loaded by Kolibri
@@ -85,10 +296,26 @@ def make_topic_tree_with_entrypoints(license, imscp_zip, imscp_dict, ims_dir,
             output HTML zip files to.
         parent_id (string, optional) - Parent ID string to concatenate to source ID.
         node_options (dict, optional) - Options to pass to content renderer in Kolibri.
+        stats (imscp.stats.PipelineStats, optional) - Stats to record stage
+            timings and counters into.
+        compression (imscp.compression.CompressionPolicy, optional) - How to
+            compress the redirect zips.
     """
     if not temp_dir:
         temp_dir = tempfile.tempdir
+    stats = stats or NULL_STATS
+
+    # Redirect zips are only shared within this call, so several packages can
+    # be converted concurrently in the same process.
+    entrypoint_zips = {}
+    with stats.stage('make_topic_tree_with_entrypoints'):
+        return _make_topic_tree_with_entrypoints(license, imscp_zip, imscp_dict,
+                temp_dir, parent_id, node_options, entrypoint_zips, stats,
+                compression)
+
 
+def _make_topic_tree_with_entrypoints(license, imscp_zip, imscp_dict,
+        temp_dir, parent_id, node_options, entrypoint_zips, stats, compression):
     source_id = imscp_dict['identifier']
     assert source_id, "{} has no identifier, parent id = {}".format(os.path.basename(imscp_zip), parent_id)
     if parent_id:
@@ -99,29 +326,34 @@ def make_topic_tree_with_entrypoints(license, imscp_zip, imscp_dict, ims_dir,
             source_id=source_id,
             title=imscp_dict['title']
         )
+        stats.incr('topic_nodes')
         counter = 1
         for child in imscp_dict['children']:
             # We will get duplicate IDs if we don't have any ID set.
             if not child['identifier']:
                 child['identifier'] = 'item{}'.format(counter)
-            topic_node.add_child(make_topic_tree_with_entrypoints(
-                    license, imscp_zip, child, ims_dir,
-                    temp_dir=temp_dir, parent_id=source_id, node_options=node_options))
+            topic_node.add_child(_make_topic_tree_with_entrypoints(
+                    license, imscp_zip, child, temp_dir, source_id,
+                    node_options, entrypoint_zips, stats, compression))
             counter += 1
         return topic_node
     else:
         if imscp_dict['type'] == 'webcontent':
-            entrypoint_dir = os.path.join(temp_dir, 'entrypoint')
-            if os.path.exists(entrypoint_dir):
-                shutil.rmtree(entrypoint_dir)
-            os.makedirs(entrypoint_dir)
-            index = os.path.join(entrypoint_dir, "index.html")
             entrypoint_url = '/zipcontent/{}/{}'.format(os.path.basename(imscp_zip), imscp_dict['href'])
-            f = open(index, "w", encoding="utf-8")
-            f.write(ENTRYPOINT_TEMPLATE.format(entrypoint_url))
-            f.close()
+            zip_path = entrypoint_zips.get(entrypoint_url)
+            if zip_path is None:
+                with stats.stage('entrypoint_zip'):
+                    index = ENTRYPOINT_TEMPLATE.format(entrypoint_url).encode('utf-8')
+                    data = predictable_zip_bytes([('index.html', index)],
+                            policy=compression)
+                    zip_path = save_zip_bytes(data, temp_dir)
+                entrypoint_zips[entrypoint_url] = zip_path
+                stats.incr('zips_built')
+                stats.incr('bytes_written', len(data))
+            else:
+                stats.incr('entrypoint_zips_reused')
+            stats.incr('html5_nodes')
 
-            zip_path = create_predictable_zip(entrypoint_dir)
             html5_node = nodes.HTML5AppNode(
                 source_id=source_id,
                 title=imscp_dict.get('title'),
@@ -141,75 +373,185 @@ def make_topic_tree_with_entrypoints(license, imscp_zip, imscp_dict, ims_dir,
 
 
 def create_html5_app_node(license, content_dict, ims_dir, scraper_class=None,
-        temp_dir=None, needs_scorm_support=False):
+        temp_dir=None, needs_scorm_support=False, cache=None, stats=None,
+        shared_scorm_zip=False, shared_files=None, dependency_zips=(),
+        scrape_session=None, compression=None):
+    """Return an HTML5AppNode for a webcontent leaf, building its HTML zip.
+
+    Args:
+        needs_scorm_support (optional) - Add the SCORM shim to SCOs.
+        shared_scorm_zip (optional) - Load the SCORM shim of SCOs from one
+            HTML5 dependency zip shared by all of them, instead of adding
+            a copy of it to each app's zip. Not used with a scraper_class.
+        shared_files (optional) - Dict of name -> base URL of files to leave
+            out of the app's zip, from imscp.shared.SharedAssets.build.
+        dependency_zips (optional) - Paths of HTML5 dependency zips to add
+            to the node, e.g. the ones shared_files were moved to.
+        See make_topic_tree for the other args.
+    """
+    shared_scorm_zip = shared_scorm_zip and not scraper_class
+    zip_path = build_html5_zip(content_dict, ims_dir,
+            scraper_class=scraper_class, temp_dir=temp_dir,
+            needs_scorm_support=needs_scorm_support, cache=cache, stats=stats,
+            shared_scorm_zip=shared_scorm_zip, shared_files=shared_files,
+            scrape_session=scrape_session, compression=compression)
+    if stats is not None:
+        stats.incr('html5_nodes')
+    dependency_zips = list(dependency_zips)
+    if (shared_scorm_zip and needs_scorm_support
+            and content_dict.get('scormtype') == 'sco'):
+        dependency_zips.append(scorm_dependency_zip(temp_dir))
+    return html5_app_node(license, content_dict, zip_path, dependency_zips)
+
+
+def html5_app_node(license, content_dict, zip_path, dependency_zips=()):
+    return nodes.HTML5AppNode(
+        source_id=content_dict['identifier'],
+        title=content_dict.get('title'),
+        license=license,
+        files=[files.HTMLZipFile(zip_path)] + [
+            files.HTMLZipFile(path, preset=format_presets.HTML5_DEPENDENCY_ZIP)
+            for path in dependency_zips],
+    )
+
+
+def build_html5_zip(content_dict, ims_dir, scraper_class=None, temp_dir=None,
+        needs_scorm_support=False, cache=None, stats=None,
+        shared_scorm_zip=False, shared_files=None, scrape_session=None,
+        compression=None):
+    """Build the HTML zip file for a webcontent leaf and return its path.
+
+    If a cache is given and already has a zip built from the same files and
+    options, that zip is returned without building anything.
+
+    shared_files is a dict of name -> base URL of files moved to dependency
+    zips (see imscp.shared.SharedAssets), which are left out of the zip.
+
+    With a scraper_class, the page is scraped through scrape_session if one
+    is given (see imscp.scraping.ScrapeSession). Otherwise the zip's members
+    are compressed as the compression policy says, if one is given.
+    """
+    stats = stats or NULL_STATS
+    if cache is not None:
+        with stats.stage('cache_key'):
+            key = cache.key(content_dict, ims_dir, scraper_class=scraper_class,
+                    needs_scorm_support=needs_scorm_support,
+                    shared_scorm_zip=shared_scorm_zip, shared_files=shared_files,
+                    compression=compression)
+        zip_path = cache.get(key)
+        if zip_path is None:
+            stats.incr('cache_misses')
+            zip_path = build_html5_zip(content_dict, ims_dir,
+                    scraper_class=scraper_class, temp_dir=temp_dir,
+                    needs_scorm_support=needs_scorm_support, stats=stats,
+                    shared_scorm_zip=shared_scorm_zip, shared_files=shared_files,
+                    scrape_session=scrape_session, compression=compression)
+            with stats.stage('cache_put'):
+                zip_path = cache.put(key, zip_path)
+        else:
+            stats.incr('cache_hits')
+        return zip_path
+
+    package = open_package(ims_dir)
     if scraper_class:
+        # Webmixer follows links from the page itself, so it needs everything.
+        with stats.stage('extract_zip'):
+            ims_dir = package.extract_all()
         index_path = os.path.join(ims_dir, content_dict['index_file'])
 
         if '?' in index_path:
             index_path = index_path.split('?')[0]
         if '#' in index_path:
             index_path = index_path.split('#')[0]
-        if content_dict['scormtype'] == 'sco' and needs_scorm_support:
-            add_scorm_support(index_path, ims_dir)
+        if content_dict.get('scormtype') == 'sco' and needs_scorm_support:
+            with stats.stage('scorm_support'):
+                add_scorm_support(index_path, ims_dir)
 
         index_uri = pathlib.Path(os.path.abspath(index_path)).as_uri()
         zip_name = '%s.zip' % hashlib.md5(index_uri.encode('utf-8')).hexdigest()
         temp_dir = temp_dir if temp_dir else tempfile.gettempdir()
         zip_path = os.path.join(temp_dir, zip_name)
-        scraper = scraper_class(index_uri)
-        scraper.download_file(zip_path)
+        with stats.stage('webmixer_scrape'):
+            if scrape_session is not None:
+                scrape_session.scrape(scraper_class, index_uri, zip_path)
+            else:
+                scraper = scraper_class(index_uri)
+                scraper.download_file(zip_path)
         logging.info('Webmixer scraper outputted HTML app to %s' % zip_path)
 
     else:
-        with tempfile.TemporaryDirectory() as destination:
-            index_src_path = os.path.join(ims_dir, content_dict['index_file'])
-            index_dest_path = os.path.join(destination, 'index.html')
-            shutil.copyfile(index_src_path, index_dest_path)
+        entries = html5_zip_entries(package, content_dict)
+        if shared_files:
+            with stats.stage('rewrite_references'):
+                remove_shared_entries(entries, shared_files)
+        if content_dict.get('scormtype') == 'sco' and needs_scorm_support:
+            with stats.stage('scorm_support'):
+                add_scorm_entries(entries, shared_scorm_zip)
+
+        with stats.stage('compress_zip'):
+            zip_path = save_predictable_zip(entries.items(), temp_dir, raw_copy=True,
+                    policy=compression, stats=stats)
+        stats.incr('bytes_copied', sum(entry_size(entry) for entry in entries.values()))
+        stats.incr('files_copied', len(entries))
+
+    stats.incr('zips_built')
+    stats.incr('bytes_written', os.path.getsize(zip_path))
+    return zip_path
+
+
+def html5_zip_entries(package, content_dict):
+    """Return the files of the HTML zip of a webcontent leaf.
+
+    Return an ordered dict of path in zip -> imscp.ziputils entry, read
+    straight from the package without staging the files anywhere. See
+    imscp.package.app_files for how the files are laid out.
+    """
+    return collections.OrderedDict((name, package.source(href))
+            for name, href in app_files(content_dict).items())
 
-            for file_path in content_dict['files']:
-                shutil.copy(os.path.join(ims_dir, file_path), destination)
 
-            if content_dict.get('scormtype') == 'sco' and needs_scorm_support:
-                add_scorm_support(index_dest_path, destination)
+def remove_shared_entries(entries, shared_files):
+    """Leave the shared files out of HTML zip entries, in place.
 
-            #preview_in_browser(destination)
-            zip_path = create_predictable_zip(destination)
+    References to them from the pages and stylesheets left in the entries
+    are rewritten to where their dependency zip serves them.
 
-    return nodes.HTML5AppNode(
-        source_id=content_dict['identifier'],
-        title=content_dict.get('title'),
-        license=license,
-        files=[files.HTMLZipFile(zip_path)],
-    )
+    Args:
+        shared_files - Dict of name in zip -> base URL of the dependency zip
+            it was moved to, from imscp.shared.SharedAssets.build.
+    """
+    for name in shared_files:
+        entries.pop(name, None)
+    for name, entry in entries.items():
+        if name == 'index.html' or name.lower().endswith(REWRITE_EXTENSIONS):
+            entries[name] = rewrite_references(read_entry(entry), shared_files)
 
 
-def add_scorm_support(index_file_path, dest_dir):
-    with open(index_file_path, 'r+') as index_file:
-        index_contents = index_file.read()
-
-        is_hot_potatoes = False
-        doc = BeautifulSoup(index_contents, "html.parser")
-        author_tag = doc.find('meta', attrs={'name': 'author'})
-        if author_tag:
-            is_hot_potatoes = 'Hot Potatoes' in author_tag.get('content', '')
-
-        # Copy scorm JS files to a scorm/ dir in destination dir
-        scorm_dir = pathlib.Path(os.path.join(dest_dir, 'le-scorm'))
-        scorm_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copy('src/scorm_handlers.js', scorm_dir)
-        shutil.copy('src/scormAPI.js', scorm_dir)
-
-        # Add links to those script tags into the <head> of the index.html
-        scorm_api = doc.new_tag('script', src='le-scorm/scormAPI.js')
-        scorm_handlers = doc.new_tag('script', src='le-scorm/scorm_handlers.js')
-        if is_hot_potatoes:
-            doc.head.append(scorm_api)
-            doc.head.append(scorm_handlers)
-        else:
-            doc.head.insert(0, scorm_api)
-            doc.head.insert(1, scorm_handlers)
+def add_scorm_entries(entries, shared_scorm_zip=False):
+    """Add the SCORM shim to the index.html of HTML zip entries, in place.
 
-        # Return modified index_contents
+    With shared_scorm_zip, the scripts are loaded from the shared SCORM
+    dependency zip (see imscp.scorm.scorm_dependency_zip) instead of being
+    added to the entries.
+    """
+    data = read_entry(entries['index.html'])
+    if shared_scorm_zip:
+        entries['index.html'] = inject_scorm_scripts(data, scorm_dependency_url())
+    else:
+        entries['index.html'] = inject_scorm_scripts(data)
+        entries.update(scorm_assets())
+
+
+def add_scorm_support(index_file_path, dest_dir):
+    """Add the SCORM shim to the page at index_file_path and its scripts to dest_dir."""
+    with open(index_file_path, 'r+b') as index_file:
+        index_contents = inject_scorm_scripts(index_file.read())
         index_file.seek(0)
-        index_file.write(str(doc))
+        index_file.write(index_contents)
         index_file.truncate()
+
+    for path, content in scorm_assets():
+        dest_path = os.path.join(dest_dir, *path.split('/'))
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with open(dest_path, 'wb') as f:
+            f.write(content)
@@ -0,0 +1,127 @@
+import functools
+import hashlib
+import os
+import pkgutil
+import re
+import tempfile
+
+from imscp.ziputils import atomic_write, predictable_zip_bytes
+
+
+SCORM_FILES = ('scormAPI.js', 'scorm_handlers.js')
+
+SCORM_DIR = 'le-scorm'
+
+# How far into a page to look for its <head>, author <meta> and </head>.
+SCAN_LIMIT = 1024 * 1024
+
+HEAD_RE = re.compile(br'<head(?:\s[^>]*)?>', re.IGNORECASE)
+HEAD_END_RE = re.compile(br'</head\s*>', re.IGNORECASE)
+HTML_RE = re.compile(br'<html(?:\s[^>]*)?>', re.IGNORECASE)
+META_RE = re.compile(br'<meta\s[^>]*>', re.IGNORECASE)
+AUTHOR_RE = re.compile(br'''\bname\s*=\s*["']?author\b''', re.IGNORECASE)
+CONTENT_RE = re.compile(br'''\bcontent\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]*))''', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=None)
+def scorm_assets():
+    """Return a tuple of (path in zip, bytes) of the SCORM shim's JS files.
+
+    Read once from the package data.
+    """
+    return tuple(('%s/%s' % (SCORM_DIR, filename), pkgutil.get_data('imscp', 'js/%s' % filename))
+            for filename in SCORM_FILES)
+
+
+def scorm_script_srcs(base_url=''):
+    return [base_url + path for path, _ in scorm_assets()]
+
+
+def inject_scorm_scripts(html, base_url=''):
+    """Return the bytes of an HTML page with the SCORM shim's <script> tags added.
+
+    The tags are spliced into the page as is, without parsing or
+    reserializing the rest of it, by scanning at most SCAN_LIMIT bytes for
+    its <head>, skipping HTML comments. Hot Potatoes pages get the scripts at the end of their
+    <head>, after their own scripts; any other page at its start.
+
+    Args:
+        html - Bytes of the page.
+        base_url (optional) - Prefix of the scripts' src, e.g. the URL of a
+            shared SCORM dependency zip. By default they are loaded from
+            le-scorm/ next to the page.
+    """
+    srcs = [src.encode('utf-8') for src in scorm_script_srcs(base_url)]
+    if html.find(srcs[0], 0, SCAN_LIMIT) != -1:
+        # Already added, e.g. to a page of an extracted package built twice.
+        return html
+    scripts = b''.join(b'<script src="%s"></script>' % src for src in srcs)
+
+    head = _search_tag(HEAD_RE, html, 0, SCAN_LIMIT)
+    if head is None:
+        # Browsers put anything before <body> in an implied <head> anyway.
+        html_tag = _search_tag(HTML_RE, html, 0, SCAN_LIMIT)
+        position = html_tag.end() if html_tag else 0
+        return html[:position] + b'<head>' + scripts + b'</head>' + html[position:]
+
+    head_end = _search_tag(HEAD_END_RE, html, head.end(), SCAN_LIMIT)
+    if head_end is not None and _is_hot_potatoes(html, head.end(), head_end.start()):
+        position = head_end.start()
+    else:
+        position = head.end()
+    return html[:position] + scripts + html[position:]
+
+
+def _search_tag(pattern, html, start, end):
+    # Return the first match of pattern in html[start:end] that isn't in an
+    # HTML comment. A comment left open hides the rest of the page.
+    while True:
+        match = pattern.search(html, start, end)
+        if match is None:
+            return None
+        comment = html.find(b'<!--', start, match.start())
+        if comment == -1:
+            return match
+        comment_end = html.find(b'-->', comment + 4, end)
+        if comment_end == -1:
+            return None
+        start = comment_end + 3
+
+
+def _is_hot_potatoes(html, start, end):
+    meta = _search_tag(META_RE, html, start, end)
+    while meta is not None:
+        tag = meta.group(0)
+        if AUTHOR_RE.search(tag):
+            content = CONTENT_RE.search(tag)
+            return bool(content) and b'Hot Potatoes' in b''.join(g or b'' for g in content.groups())
+        meta = _search_tag(META_RE, html, meta.end(), end)
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def scorm_zip_bytes():
+    """Return the bytes of a predictable zip of the SCORM shim's JS files."""
+    return predictable_zip_bytes(scorm_assets())
+
+
+def scorm_dependency_zip(temp_dir=None):
+    """Return the path of a zip of the SCORM shim, to share between apps.
+
+    The zip is named by the MD5 of its contents, which is also the name
+    Kolibri stores it under, so apps can load the scripts from
+    /zipcontent/<name>/ (see scorm_dependency_url). It is only written once
+    per temp_dir.
+    """
+    data = scorm_zip_bytes()
+    temp_dir = temp_dir or tempfile.gettempdir()
+    zip_path = os.path.join(temp_dir, '%s.zip' % hashlib.md5(data).hexdigest())
+    if not os.path.exists(zip_path):
+        with atomic_write(zip_path) as f:
+            f.write(data)
+    return zip_path
+
+
+def scorm_dependency_url():
+    """Return the base URL of the files of the shared SCORM dependency zip."""
+    return '/zipcontent/%s.zip/' % hashlib.md5(scorm_zip_bytes()).hexdigest()
@@ -0,0 +1,151 @@
+import collections
+import logging
+import os
+import threading
+
+from ricecooker.utils import downloader, html_writer
+
+
+# The session the current thread is scraping for, if any.
+_scraping = threading.local()
+_hook_lock = threading.Lock()
+_downloader_read = downloader.read
+
+
+class ScrapeSession(object):
+    """Shares fetched assets between the Webmixer scrapes of a package.
+
+    Pass one to make_topic_tree as scrape_session, along with a
+    scraper_class. The pages of the package are then scraped concurrently by
+    up to jobs threads, and every stylesheet, script, image or font a
+    scraper writes to an app's zip is only read once per session, keyed by
+    its resolved URI, and copied from memory into the zips of the other
+    apps using it. While a page is scraped, plain downloader.read calls
+    (without loadjs or a requests session, as webmixer's StyleTag does to
+    fetch stylesheets before rewriting their URLs) go through the same
+    cache, so a stylesheet shared by the pages is downloaded once, though
+    it is still parsed for each page. A page (index URI) is only scraped
+    once per session.
+
+    Args:
+        jobs (int, optional) - Number of pages to scrape concurrently.
+            Defaults to 4.
+        max_cache_size (int, optional) - Maximum total size in bytes of the
+            assets kept in memory. Assets read once it is full aren't kept.
+    """
+
+    def __init__(self, jobs=4, max_cache_size=256 * 1024 * 1024):
+        self.jobs = jobs
+        self.max_cache_size = max_cache_size
+        self.cache_size = 0
+        self.counts = collections.Counter()
+        self._assets = {}
+        self._scrapers = {}
+        self._scraped = set()
+        self._page_locks = {}
+        self._lock = threading.Lock()
+        _install_read_hook()
+
+    def __repr__(self):
+        return 'ScrapeSession(jobs=%r)' % self.jobs
+
+    def read(self, url):
+        """Return the bytes of the asset at url, reading it only once."""
+        with self._lock:
+            content = self._assets.get(url)
+            self.counts['asset_hits' if content is not None else 'asset_misses'] += 1
+        if content is not None:
+            return content
+        content = _downloader_read(url)
+        with self._lock:
+            if url not in self._assets and self.cache_size + len(content) <= self.max_cache_size:
+                self._assets[url] = content
+                self.cache_size += len(content)
+        return content
+
+    def scraper_class(self, scraper_class):
+        """Return a subclass of scraper_class that writes zips through this session."""
+        with self._lock:
+            session_class = self._scrapers.get(scraper_class)
+            if session_class is None:
+                session_class = self._scrapers[scraper_class] = type(
+                        scraper_class.__name__, (scraper_class,),
+                        {'download_file': _session_download_file(self)})
+            return session_class
+
+    def scrape(self, scraper_class, index_uri, zip_path):
+        """Scrape the page at index_uri to zip_path, unless it already was.
+
+        Pages with the same index URI are written to the same zip_path, so
+        concurrent scrapes of one page wait for the first one to finish.
+        """
+        with self._lock:
+            page_lock = self._page_locks.setdefault(zip_path, threading.Lock())
+        with page_lock:
+            if zip_path in self._scraped and os.path.exists(zip_path):
+                self._count('pages_reused')
+                return
+            _scraping.session = self
+            try:
+                scraper = self.scraper_class(scraper_class)(index_uri)
+                scraper.download_file(zip_path)
+            finally:
+                _scraping.session = None
+            self._count('pages_scraped')
+            self._scraped.add(zip_path)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def report(self):
+        """Return counts of pages scraped and reused, and asset cache hits and misses."""
+        with self._lock:
+            report = collections.OrderedDict((name, self.counts[name]) for name in (
+                    'pages_scraped', 'pages_reused', 'asset_hits', 'asset_misses'))
+            report['cache_size'] = self.cache_size
+            return report
+
+
+class SessionHTMLWriter(html_writer.HTMLWriter):
+    """An HTMLWriter that reads the URLs it writes through a ScrapeSession."""
+
+    def __init__(self, write_to_path, session, mode='w'):
+        super().__init__(write_to_path, mode=mode)
+        self.session = session
+
+    def write_url(self, url, filename, directory=None):
+        filepath = '{}/{}'.format(directory.rstrip('/'), filename) if directory else filename
+        if not self.contains(filepath):
+            self._write_to_zipfile(filepath, self.session.read(url))
+        return filepath
+
+
+def _session_read(path, *args, **kwargs):
+    # Replaces downloader.read, which webmixer looks up on the module at
+    # each call; other threads and calls that load JS or pass a requests
+    # session read as before.
+    session = getattr(_scraping, 'session', None)
+    if session is None or args or kwargs.get('loadjs') or set(kwargs) - {'loadjs'}:
+        return _downloader_read(path, *args, **kwargs)
+    return session.read(path)
+
+
+def _install_read_hook():
+    with _hook_lock:
+        if downloader.read is _downloader_read:
+            downloader.read = _session_read
+
+
+def _session_download_file(session):
+    # Same as webmixer's HTMLPageScraper.download_file, with the session's
+    # writer.
+    def download_file(self, write_to_path):
+        with SessionHTMLWriter(write_to_path, session) as zipper:
+            try:
+                self.zipper = zipper
+                self.to_zip(filename='index.html')
+            except Exception as e:
+                # Otherwise the only error is that index.html is missing.
+                logging.error(str(e))
+    return download_file
@@ -0,0 +1,158 @@
+import collections
+import hashlib
+import logging
+import os
+import re
+from urllib.parse import unquote
+
+from imscp.package import app_files, member_name, open_package
+from imscp.stats import NULL_STATS
+from imscp.ziputils import save_predictable_zip
+
+
+GROUPINGS = ('single', 'leaves')
+
+# Pages and stylesheets whose references to shared files are rewritten.
+REWRITE_EXTENSIONS = ('.html', '.htm', '.xhtml', '.css')
+
+# src="x", href='x', background=x, CSS url(x) and @import "x" references to a
+# plain file name, which is how flattened apps refer to their files. srcset
+# lists aren't rewritten.
+REFERENCE_RE = re.compile(
+    br'''((?:\b(?:src|href|background)\s*=\s*|\burl\(\s*|@import\s+(?!url\s*\())["']?)(?:\./)?([^"'\s<>()/\\?#]+)''',
+    re.IGNORECASE)
+
+
+class SharedAssets(object):
+    """Moves files shared by many HTML apps into HTML5 dependency zips.
+
+    Files that end up in the zips of at least min_leaves webcontent leaves
+    (typically the CSS, JS, fonts and images of <dependency> resources) are
+    built once into a dependency zip instead of into every app. References
+    to them from the apps' pages and stylesheets are rewritten to
+    /zipcontent/<dependency zip>/<file>, which is where Kolibri serves the
+    files of the dependency zips of an app. References made from JavaScript
+    can't be rewritten, so don't use this for apps that build URLs in code.
+
+    Args:
+        min_leaves (int, optional) - Number of leaves a file must be shared
+            by to be moved to a dependency zip.
+        grouping (str, optional) - 'single' to put every shared file in one
+            dependency zip, or 'leaves' to make one zip per distinct set of
+            leaves sharing files, so that each app only depends on files it
+            uses.
+    """
+
+    def __init__(self, min_leaves=2, grouping='single'):
+        if grouping not in GROUPINGS:
+            raise ValueError('grouping must be one of %s' % ', '.join(GROUPINGS))
+        self.min_leaves = max(min_leaves, 2)
+        self.grouping = grouping
+
+    def __repr__(self):
+        return 'SharedAssets(min_leaves=%r, grouping=%r)' % (self.min_leaves, self.grouping)
+
+    def groups(self, leaves, ims_dir):
+        """Return the groups of files to put in dependency zips.
+
+        Return a list of (files, users) pairs, one per dependency zip, where
+        files is an ordered dict of name in zip -> href of the shared files,
+        and users a dict of name -> indexes in leaves of the leaves that use
+        that file.
+
+        Args:
+            leaves - List of webcontent leaf dicts.
+            ims_dir - Directory of IMSCP, or a ZipPackage.
+        """
+        package = open_package(ims_dir)
+        users = collections.OrderedDict()
+        hrefs = {}
+        for index, leaf in enumerate(leaves):
+            for name, href in app_files(leaf).items():
+                if name == 'index.html':
+                    continue
+                key = (name, member_name(href))
+                users.setdefault(key, []).append(index)
+                hrefs.setdefault(key, href)
+
+        shared = [(key, indexes) for key, indexes in users.items()
+                if len(indexes) >= self.min_leaves and package.exists(key[1])]
+        if self.grouping == 'single':
+            # Different files with the same name can't both be in one zip,
+            # so only the one shared by the most leaves is.
+            best = {}
+            for key, indexes in shared:
+                if len(indexes) > len(best.get(key[0], ((), ()))[1]):
+                    best[key[0]] = (key, indexes)
+            shared = [(key, indexes) for key, indexes in shared if best[key[0]][0] == key]
+            groups = [shared] if shared else []
+        else:
+            by_leaves = collections.OrderedDict()
+            for key, indexes in shared:
+                by_leaves.setdefault(tuple(indexes), []).append((key, indexes))
+            groups = list(by_leaves.values())
+
+        return [(collections.OrderedDict((key[0], hrefs[key]) for key, _ in group),
+                 dict((key[0], indexes) for key, indexes in group))
+                for group in groups]
+
+    def build(self, leaves, ims_dir, temp_dir=None, stats=None, compression=None):
+        """Build the dependency zips of the files shared between leaves.
+
+        Return a list with, for each leaf, a (shared_files, dependency_zips)
+        pair: a dict of name -> base URL of the files to leave out of the
+        leaf's zip (see build_html5_zip), and the paths of the dependency
+        zips to add to its node. compression is an optional
+        imscp.compression.CompressionPolicy for the dependency zips.
+        """
+        stats = stats or NULL_STATS
+        package = open_package(ims_dir)
+        result = [({}, []) for _ in leaves]
+        for files, users in self.groups(leaves, package):
+            with stats.stage('shared_zip'):
+                zip_path = save_predictable_zip(
+                        [(name, package.source(href)) for name, href in files.items()],
+                        temp_dir, raw_copy=True, policy=compression)
+                zip_path = _rename_to_md5(zip_path)
+            stats.incr('shared_zips_built')
+            stats.incr('shared_files', len(files))
+            stats.incr('bytes_written', os.path.getsize(zip_path))
+            base_url = '/zipcontent/%s/' % os.path.basename(zip_path)
+            leaf_indexes = set()
+            for name, indexes in users.items():
+                for index in indexes:
+                    result[index][0][name] = base_url
+                leaf_indexes.update(indexes)
+            for index in sorted(leaf_indexes):
+                result[index][1].append(zip_path)
+            logging.info('Moved %d files shared by %d apps to %s' % (
+                    len(files), len(leaf_indexes), zip_path))
+        return result
+
+
+def _rename_to_md5(zip_path):
+    # Kolibri stores files under the MD5 of their contents, so that is also
+    # the name the dependency zip is served under.
+    digest = hashlib.md5()
+    with open(zip_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    md5_path = os.path.join(os.path.dirname(zip_path), '%s.zip' % digest.hexdigest())
+    os.replace(zip_path, md5_path)
+    return md5_path
+
+
+def rewrite_references(data, shared_files):
+    """Return page or stylesheet bytes with references to shared files rewritten.
+
+    Args:
+        data - Bytes of an HTML page or CSS file.
+        shared_files - Dict of file name -> base URL it is now served from.
+    """
+    def replace(match):
+        name = unquote(match.group(2).decode('utf-8', 'replace'))
+        base_url = shared_files.get(name)
+        if base_url is None:
+            return match.group(0)
+        return match.group(1) + base_url.encode('utf-8') + match.group(2)
+    return REFERENCE_RE.sub(replace, data)
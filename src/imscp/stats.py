@@ -0,0 +1,140 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+
+class PipelineStats(object):
+    """Per-stage durations and counters of converting one package.
+
+    Pass the same PipelineStats to extract_from_zip, extract_from_dir,
+    make_topic_tree, make_topic_tree_with_entrypoints or
+    create_html5_app_node and they all record into it. Stages can nest
+    (e.g. collect_metadata runs inside walk_items), so stage times don't add
+    up to the total. Zips built by worker processes or threads are timed by
+    each worker and merged back, so their stage times are summed over
+    workers rather than being wall time.
+
+    Args:
+        package (optional) - Name of the package, included in the report.
+        callback (optional) - Called as callback(kind, name, value) for every
+            finished stage ('stage', name, seconds) and counter increment
+            ('counter', name, amount), to forward them to a metrics system
+            as they happen.
+    """
+
+    def __init__(self, package=None, callback=None):
+        self.package = package
+        self.callback = callback
+        self.stages = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.info = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'PipelineStats(%r)' % self.package
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that adds the time spent in its block to stage name."""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += calls
+            stage['seconds'] += seconds
+        if self.callback:
+            self.callback('stage', name, seconds)
+
+    def incr(self, name, amount=1):
+        """Add amount to counter name."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        if self.callback:
+            self.callback('counter', name, amount)
+
+    def set(self, name, value):
+        """Record a piece of information, e.g. the manifest encoding strategy."""
+        self.info[name] = value
+
+    def merge(self, report):
+        """Add the stages, counters and info of another report to this one."""
+        for name, stage in report['stages'].items():
+            self.add_time(name, stage['seconds'], stage['calls'])
+        for name, amount in report['counters'].items():
+            self.incr(name, amount)
+        for name, value in report['info'].items():
+            self.info.setdefault(name, value)
+
+    def report(self):
+        """Return a JSON-serializable dict of everything recorded."""
+        with self._lock:
+            return {
+                'package': self.package,
+                'stages': collections.OrderedDict(
+                    (name, {'calls': stage['calls'], 'seconds': round(stage['seconds'], 6)})
+                    for name, stage in self.stages.items()),
+                'counters': collections.OrderedDict(self.counters),
+                'info': collections.OrderedDict(self.info),
+            }
+
+    def metrics(self, prefix='imscp'):
+        """Return the report flattened to a dict of metric name -> number.
+
+        e.g. {'imscp.stage.parse_manifest.seconds': 0.01,
+              'imscp.counter.files_copied': 12, ...}
+        """
+        report = self.report()
+        metrics = collections.OrderedDict()
+        for name, stage in report['stages'].items():
+            metrics['%s.stage.%s.seconds' % (prefix, name)] = stage['seconds']
+            metrics['%s.stage.%s.calls' % (prefix, name)] = stage['calls']
+        for name, amount in report['counters'].items():
+            metrics['%s.counter.%s' % (prefix, name)] = amount
+        return metrics
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **kwargs)
+
+
+class NullStats(object):
+    """Stats that record nothing, used when no PipelineStats is passed in."""
+
+    package = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        yield self
+
+    def add_time(self, name, seconds, calls=1):
+        pass
+
+    def incr(self, name, amount=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def merge(self, report):
+        pass
+
+    def report(self):
+        return {'package': None, 'stages': {}, 'counters': {}, 'info': {}}
+
+
+NULL_STATS = NullStats()
@@ -0,0 +1,204 @@
+import asyncio
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import logging
+import threading
+import uuid
+
+from ricecooker.classes import nodes
+
+from imscp.core import LOM_SECTIONS, iter_items
+from imscp.index import leaf_sizes
+from imscp.package import member_name, open_package
+from imscp.ricecooker_utils import _build_html5_zip_job, html5_app_node
+from imscp.stats import NULL_STATS
+
+
+# One finished node: path is the tuple of identifiers of its ancestors (as
+# in imscp.core.iter_items), item its dict and node the ricecooker node.
+StreamedNode = collections.namedtuple('StreamedNode', ['path', 'item', 'node'])
+
+_DONE = object()
+
+
+async def stream_nodes(license, ims_dir, scraper_class=None, temp_dir=None,
+        jobs=None, use_threads=False, cache=None, stats=None, compression=None,
+        max_pending=16, max_pending_bytes=None, metadata_sections=LOM_SECTIONS):
+    """Convert a package to ricecooker nodes, yielding each one as soon as it is built.
+
+    An async generator of StreamedNodes for every organization and item of
+    the package, in tree order. The manifest is streamed with
+    imscp.core.iter_items in a thread, and the zips of webcontent leaves are
+    built by jobs workers as soon as their items are parsed, so parsing,
+    reading files and compressing overlap, and a chef can upload or
+    otherwise handle the first nodes while the rest are still converted.
+
+    Every node is added to its topic's node before it is yielded (so
+    organizations, which are yielded first, end up with their whole tree),
+    and topics are yielded before their children. Items and zips are only
+    parsed or built ahead of the node being handled up to max_pending
+    leaves, or max_pending_bytes of files for their apps, so that a slow
+    consumer caps the memory and temp_dir space in use. Leave the loop
+    early (or call aclose()) to stop converting.
+
+    With a scraper_class, a ZipPackage is extracted once before any leaf
+    is built, and leaves with the same index page share one zip.
+
+    Args:
+        license - License to apply to content nodes.
+        ims_dir (string or ZipPackage) - Path of directory of IMSCP, or a
+            ZipPackage.
+        jobs (int, optional) - Number of workers to build HTML zip files in.
+            Defaults to the number of CPUs.
+        max_pending (int, optional) - Maximum number of items parsed, and
+            of leaves built or being built, ahead of the node yielded.
+        max_pending_bytes (int, optional) - Maximum total size of the files
+            of the apps built or being built ahead of the node yielded. An
+            app bigger than that is still built, on its own.
+        metadata_sections (optional) - LOM sections to collect metadata from.
+        See imscp.ricecooker_utils.make_topic_tree for the other args.
+    """
+    stats = stats or NULL_STATS
+    loop = asyncio.get_running_loop()
+    package = open_package(ims_dir)
+    items = asyncio.Queue(maxsize=max_pending)
+    results = asyncio.Queue(maxsize=max_pending)
+    budget = _ByteBudget(max_pending_bytes)
+    stopped = threading.Event()
+    parser = ThreadPoolExecutor(max_workers=1)
+    executor = (ThreadPoolExecutor if use_threads else ProcessPoolExecutor)(max_workers=jobs)
+    build = functools.partial(_build_html5_zip_job, ims_dir=package,
+            record_stats=stats is not NULL_STATS, scraper_class=scraper_class,
+            temp_dir=temp_dir, cache=cache, compression=compression)
+    # Build futures not handled by the consumer yet.
+    building = set()
+
+    def parse():
+        # Runs in the parser thread; waiting for room in the queue holds off
+        # parsing further.
+        def put(value):
+            asyncio.run_coroutine_threadsafe(items.put(value), loop).result()
+        try:
+            if scraper_class:
+                # Before any leaf is built, so workers get the package
+                # already extracted (see build_html5_zips).
+                package.extract_all()
+            for streamed in iter_items(package, license, metadata_sections):
+                if stopped.is_set():
+                    return
+                put(streamed)
+        finally:
+            if not stopped.is_set():
+                put(_DONE)
+
+    async def dispatch():
+        # With a scraper, leaves with the same index page share one zip.
+        scraped = {}
+        try:
+            while True:
+                streamed = await items.get()
+                if streamed is _DONE:
+                    await parsing
+                    return
+                future, size = None, 0
+                if streamed.is_leaf and streamed.item.get('type') == 'webcontent':
+                    page = member_name(streamed.item['index_file']) if scraper_class else None
+                    future = scraped.get(page)
+                    if future is None:
+                        # Reading the sizes stats files or the zip's central
+                        # directory, so it is kept off the event loop too.
+                        size = (await loop.run_in_executor(None, leaf_sizes,
+                                [streamed.item], package))[0]
+                        await budget.acquire(size)
+                        future = loop.run_in_executor(executor,
+                                functools.partial(build, streamed.item))
+                        building.add(future)
+                        if page is not None:
+                            scraped[page] = future
+                await results.put((streamed, future, size))
+        finally:
+            if not stopped.is_set():
+                await results.put(_DONE)
+
+    parsing = loop.run_in_executor(parser, parse)
+    dispatching = asyncio.ensure_future(dispatch())
+    finished = False
+    try:
+        # Topic nodes of the items on the path of the current one.
+        topics = []
+        while True:
+            result = await results.get()
+            if result is _DONE:
+                await dispatching
+                finished = True
+                if cache is not None:
+                    cache.trim()
+                return
+            streamed, future, size = result
+            path, item = streamed.path, streamed.item
+            del topics[len(path):]
+            if future is not None:
+                zip_path, report = await future
+                if report is not None and future in building:
+                    stats.merge(report)
+                building.discard(future)
+                if cache is not None:
+                    cache.pin(zip_path)
+                node = html5_app_node(license, item, zip_path)
+                stats.incr('html5_nodes')
+            elif streamed.is_leaf:
+                logging.warning('Content type %s not supported yet.' % item.get('type'))
+                continue
+            else:
+                node = nodes.TopicNode(source_id=str(uuid.uuid4()), title=item.get('title'))
+                stats.incr('topic_nodes')
+                topics.append(node)
+            if path and len(topics) >= len(path):
+                topics[len(path) - 1].add_child(node)
+            yield StreamedNode(path, item, node)
+            budget.release(size)
+    finally:
+        stopped.set()
+        if not finished:
+            dispatching.cancel()
+            for future in building:
+                future.cancel()
+            # Let a parser thread waiting for room in the queue stop.
+            while not parsing.done():
+                while not items.empty():
+                    items.get_nowait()
+                await asyncio.sleep(0.01)
+            # Retrieve the outcome of everything left, so that none of them
+            # is reported as never retrieved.
+            await asyncio.gather(dispatching, parsing, *building, return_exceptions=True)
+        parser.shutdown(wait=finished)
+        executor.shutdown(wait=finished)
+
+
+class _ByteBudget(object):
+    """Bytes of apps that may be built ahead of the consumer."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        if self.max_bytes is None:
+            return
+        async with self._condition:
+            await self._condition.wait_for(
+                    lambda: not self.in_use or self.in_use + size <= self.max_bytes)
+            self.in_use += size
+
+    def release(self, size):
+        if self.max_bytes is None or not size:
+            return
+        self.in_use -= size
+        # Wake waiters without blocking the consumer.
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify_all()
@@ -0,0 +1,263 @@
+import collections
+import contextlib
+import functools
+import io
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+
+from imscp.stats import NULL_STATS
+
+
+# Same neutral metadata as ricecooker's create_predictable_zip, so that zips
+# built here are byte-for-byte identical to the ones it builds.
+NEUTRAL_DATE_TIME = (2015, 10, 21, 7, 28, 0)
+
+# Permissions (?rw-------) zipfile gives the members it writes, set on every
+# member here so that raw copied members get them too.
+FILE_ATTRIBUTES = 0o600 << 16
+
+# Private zipfile internals _write_raw relies on, present in Python 3.7 to
+# 3.13. Members are streamed instead if they are ever missing.
+RAW_COPY_ATTRIBUTES = ('_lock', '_writecheck', '_didModify', 'start_dir', 'fp',
+        'filelist', 'NameToInfo')
+
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Size of the incompressible data deflated to estimate the time storing
+# members saved.
+SAVINGS_SAMPLE_SIZE = 256 * 1024
+
+# A member of an open source zip file, to be copied into a new zip.
+ZipMember = collections.namedtuple('ZipMember', ['zip_file', 'info'])
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb'):
+    """Context manager that writes a file under a temp name and then moves it to path.
+
+    Yields the temp file, opened with mode, next to path. It only replaces
+    path once the block is done, so concurrent writers and readers never see
+    a partial file, and it is removed if the block raises.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.part')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_predictable_zip(output, entries, raw_copy=False, policy=None, stats=None):
+    """Write entries to a zip with predictable order and metadata.
+
+    Contents are streamed into the zip, so files are never staged on disk
+    or held in memory whole.
+
+    Args:
+        output - Path or binary file object to write the zip to.
+        entries - Iterable of (path in zip, content) pairs, where content is
+            bytes, the path of a file, or a ZipMember. Written in sorted path
+            order, like create_predictable_zip.
+        raw_copy (optional) - Copy ZipMembers that are already deflated
+            without decompressing and recompressing them. The zip is still
+            the same every time it is built from the same source zip, but
+            those members aren't byte-for-byte what create_predictable_zip
+            would have compressed them to. With a policy, members it stores
+            are also copied as is if they are stored in the source zip.
+        policy (imscp.compression.CompressionPolicy, optional) - Decides
+            which members to store and the deflate level of the others.
+            By default every member is deflated at the default level.
+        stats (imscp.stats.PipelineStats, optional) - Stats to record the
+            files and bytes deflated, stored and raw copied into, and the
+            time spent deflating and storing. The time deflating the stored
+            members would have taken is estimated from the speed deflate
+            has on incompressible data, and recorded as stage
+            deflate_skipped.
+    """
+    stats = stats or NULL_STATS
+    raw_files = {}
+    try:
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            raw_copy = raw_copy and can_write_raw(zip_file)
+            for filepath, content in sorted(entries, key=lambda entry: entry[0]):
+                info = zipfile.ZipInfo(filepath.replace('\\', '/'), date_time=NEUTRAL_DATE_TIME)
+                size = entry_size(content)
+                compress_type, level = zipfile.ZIP_DEFLATED, None
+                if policy is not None:
+                    compress_type, level = policy.method(info.filename, size)
+                info.compress_type = compress_type
+                _set_compress_level(info, level)
+                info.comment = b''
+                info.create_system = 0
+                info.external_attr = FILE_ATTRIBUTES
+                if (raw_copy and isinstance(content, ZipMember)
+                        and can_copy_raw(content.info, compress_type)):
+                    source_path = content.zip_file.filename
+                    if source_path not in raw_files:
+                        raw_files[source_path] = open(source_path, 'rb')
+                    _write_raw(zip_file, info, content.info, raw_files[source_path])
+                    stats.incr('files_raw_copied')
+                    continue
+
+                stored = compress_type == zipfile.ZIP_STORED
+                with stats.stage('store' if stored else 'deflate'):
+                    if isinstance(content, bytes):
+                        zip_file.writestr(info, content)
+                    elif isinstance(content, ZipMember):
+                        with content.zip_file.open(content.info) as src:
+                            _write_stream(zip_file, info, src, size)
+                    else:
+                        with open(content, 'rb') as src:
+                            _write_stream(zip_file, info, src, size)
+                stats.incr('files_stored' if stored else 'files_deflated')
+                stats.incr('bytes_stored' if stored else 'bytes_deflated', size)
+                if stored and stats is not NULL_STATS and size:
+                    stats.add_time('deflate_skipped', size / _incompressible_deflate_rate())
+    finally:
+        for raw_file in raw_files.values():
+            raw_file.close()
+
+
+def entry_size(content):
+    """Return the uncompressed size of an entry's content."""
+    if isinstance(content, bytes):
+        return len(content)
+    if isinstance(content, ZipMember):
+        return content.info.file_size
+    return os.path.getsize(content)
+
+
+def read_entry(content):
+    """Return the bytes of an entry's content (bytes, file path or ZipMember)."""
+    if isinstance(content, bytes):
+        return content
+    if isinstance(content, ZipMember):
+        with content.zip_file.open(content.info) as f:
+            return f.read()
+    with open(content, 'rb') as f:
+        return f.read()
+
+
+def can_write_raw(zip_file):
+    """Return whether members can be raw copied into zip_file by this version of zipfile."""
+    return all(hasattr(zip_file, name) for name in RAW_COPY_ATTRIBUTES)
+
+
+def can_copy_raw(info, compress_type=zipfile.ZIP_DEFLATED):
+    """Return whether the zip member info can be copied without recompressing.
+
+    That is, whether it is compressed with compress_type, which the member
+    is to be written with.
+    """
+    return (info.compress_type == compress_type
+            and not info.flag_bits & 0x1  # encrypted
+            and info.file_size < zipfile.ZIP64_LIMIT
+            and info.compress_size < zipfile.ZIP64_LIMIT)
+
+
+@functools.lru_cache(maxsize=None)
+def _incompressible_deflate_rate():
+    # Bytes per second deflate goes through on data like stored members,
+    # measured once per process, on the fastest of a few runs.
+    # Random.randbytes is only in Python 3.9+.
+    sample = random.Random(0).getrandbits(8 * SAVINGS_SAMPLE_SIZE).to_bytes(
+            SAVINGS_SAMPLE_SIZE, 'little')
+    seconds = []
+    for _ in range(3):
+        start = time.perf_counter()
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressor.compress(sample)
+        compressor.flush()
+        seconds.append(time.perf_counter() - start)
+    return SAVINGS_SAMPLE_SIZE / max(min(seconds), 1e-9)
+
+
+def _set_compress_level(info, level):
+    # ZipInfo.compress_level is public from Python 3.13, and _compresslevel
+    # (added in 3.7) is only kept as an alias of it.
+    if hasattr(zipfile.ZipInfo, 'compress_level'):
+        info.compress_level = level
+    else:
+        info._compresslevel = level
+
+
+def _write_stream(zip_file, info, src, file_size):
+    # Same as writestr, which compresses through ZipFile.open too, so the
+    # bytes written are the same as if the content was read in one go.
+    info.file_size = file_size
+    with zip_file.open(info, 'w') as dest:
+        shutil.copyfileobj(src, dest, COPY_BUFFER_SIZE)
+
+
+def _write_raw(zip_file, info, src_info, raw_file):
+    # zipfile has no public API to write already compressed data, so this
+    # does what ZipFile.open(info, 'w') does, but copies the compressed bytes
+    # of the source member instead of running them through a compressor.
+    raw_file.seek(src_info.header_offset)
+    header = raw_file.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile('Bad local header for %s' % src_info.filename)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    raw_file.seek(name_length + extra_length, os.SEEK_CUR)
+
+    info.compress_type = src_info.compress_type
+    info.CRC = src_info.CRC
+    info.compress_size = src_info.compress_size
+    info.file_size = src_info.file_size
+    info.flag_bits = 0
+    with zip_file._lock:
+        zip_file.fp.seek(zip_file.start_dir)
+        info.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(info)
+        zip_file._didModify = True
+        zip_file.fp.write(info.FileHeader(False))
+        remaining = src_info.compress_size
+        while remaining:
+            chunk = raw_file.read(min(remaining, COPY_BUFFER_SIZE))
+            if not chunk:
+                raise zipfile.BadZipFile('Truncated member %s' % src_info.filename)
+            zip_file.fp.write(chunk)
+            remaining -= len(chunk)
+        zip_file.start_dir = zip_file.fp.tell()
+        zip_file.filelist.append(info)
+        zip_file.NameToInfo[info.filename] = info
+
+
+def predictable_zip_bytes(entries, policy=None, stats=None):
+    """Return the bytes of a predictable zip of entries, built in memory."""
+    output = io.BytesIO()
+    write_predictable_zip(output, entries, policy=policy, stats=stats)
+    return output.getvalue()
+
+
+def save_predictable_zip(entries, temp_dir=None, raw_copy=False, policy=None, stats=None):
+    """Write entries to a new temporary .zip file and return its path.
+
+    See write_predictable_zip for the args.
+    """
+    fd, zip_path = tempfile.mkstemp(suffix='.zip', dir=temp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_predictable_zip(f, entries, raw_copy=raw_copy, policy=policy, stats=stats)
+    except BaseException:
+        os.remove(zip_path)
+        raise
+    return zip_path
+
+
+def save_zip_bytes(data, temp_dir=None):
+    """Write zip bytes to a new temporary .zip file and return its path."""
+    fd, zip_path = tempfile.mkstemp(suffix='.zip', dir=temp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return zip_path
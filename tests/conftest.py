@@ -0,0 +1,21 @@
+import os
+import pathlib
+import sys
+
+import pytest
+
+import packages
+
+# Run the tests against src/ without installing the package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+@pytest.fixture
+def examples_dir():
+    return pathlib.Path(__file__).parent.parent / 'examples'
+
+
+@pytest.fixture
+def package_zip(tmp_path):
+    """Path of a zip of the package in packages.py."""
+    return packages.write_package_zip(str(tmp_path / 'package.zip'))
@@ -0,0 +1,60 @@
+"""A small package with two leaves on the same page, and a scraper for it."""
+import zipfile
+
+from ricecooker.utils import downloader, html_writer
+
+
+MANIFEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1" identifier="M">
+  <organizations><organization identifier="O"><title>Org</title>
+    <item identifier="T"><title>Topic</title>
+      <item identifier="CH1" identifierref="BOOK1"><title>Chapter 1</title></item>
+      <item identifier="CH2" identifierref="BOOK2"><title>Chapter 2</title></item>
+    </item>
+    <item identifier="P" identifierref="PAGE"><title>Page</title></item>
+    <item identifier="Q" identifierref="QUIZ"><title>Quiz</title></item>
+  </organization></organizations>
+  <resources>
+    <resource identifier="BOOK1" type="webcontent" href="book/index.html#ch1">
+      <file href="book/index.html"/><file href="book/book.css"/>
+    </resource>
+    <resource identifier="BOOK2" type="webcontent" href="book/index.html#ch2">
+      <file href="book/index.html"/><file href="book/book.css"/>
+    </resource>
+    <resource identifier="PAGE" type="webcontent" href="page.html">
+      <file href="page.html"/><file href="media/image.png"/>
+    </resource>
+    <resource identifier="QUIZ" type="webcontent" href="quiz/quiz.html">
+      <file href="quiz/quiz.html"/><file href="quiz/quiz.js"/>
+    </resource>
+  </resources>
+</manifest>
+'''
+
+FILES = {
+    'book/index.html': b'<html><head></head><body><h1 id="ch1">1</h1><h1 id="ch2">2</h1></body></html>',
+    'book/book.css': b'h1 { color: blue; }\n' * 100,
+    'page.html': b'<html><head></head><body><img src="media/image.png"></body></html>',
+    'media/image.png': bytes(range(256)) * 64,
+    'quiz/quiz.html': b'<html><head><script src="quiz.js"></script></head><body></body></html>',
+    'quiz/quiz.js': b'var answers = [1, 2, 3];\n' * 200,
+}
+
+
+class PageScraper(object):
+    """Zips the page itself, like a Webmixer scraper that changes nothing."""
+
+    def __init__(self, url):
+        self.url = url
+
+    def download_file(self, write_to_path):
+        with html_writer.HTMLWriter(write_to_path) as zipper:
+            zipper.write_index_contents(downloader.read(self.url))
+
+
+def write_package_zip(path):
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('imsmanifest.xml', MANIFEST)
+        for name, content in FILES.items():
+            zip_file.writestr(name, content)
+    return path
@@ -0,0 +1,104 @@
+import os
+import zipfile
+
+from imscp.cache import ZipCache
+from imscp.core import extract_from_dir
+from imscp.package import DirPackage, ZipPackage
+from imscp.ricecooker_utils import make_topic_tree
+from imscp.stats import PipelineStats
+
+
+LEAF = {'index_file': 'index.html', 'files': ['index.html', 'style.css']}
+
+
+def write_zip(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'z' * size)
+    return path
+
+
+def write_package_zip(path, css, mtime):
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        zip_file.writestr('index.html', b'<html></html>')
+        zip_file.writestr('style.css', css)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ZipCache(str(tmp_path / 'cache'))
+    assert cache.get('abc') is None
+    path = cache.put('abc', write_zip(str(tmp_path / 'built.zip'), 10))
+    assert cache.get('abc') == path
+    # Moved, not copied.
+    assert not os.path.exists(str(tmp_path / 'built.zip'))
+    with open(path, 'rb') as f:
+        assert f.read() == b'z' * 10
+
+
+def test_key_changes_with_files_and_options(tmp_path):
+    (tmp_path / 'index.html').write_bytes(b'<html></html>')
+    (tmp_path / 'style.css').write_bytes(b'p {}')
+    cache = ZipCache(str(tmp_path / 'cache'))
+    package = DirPackage(str(tmp_path))
+    key = cache.key(LEAF, package)
+    assert cache.key(LEAF, package) == key
+    assert cache.key(LEAF, package, needs_scorm_support=True) != key
+    assert cache.key(dict(LEAF, files=['index.html']), package) != key
+
+    (tmp_path / 'style.css').write_bytes(b'p { color: red; }')
+    assert cache.key(LEAF, package) != key
+
+
+def test_key_changes_when_zip_is_replaced(tmp_path):
+    # A long-lived cache mustn't keep the checksums of the previous
+    # version of a package written to the same path.
+    path = str(tmp_path / 'package.zip')
+    cache = ZipCache(str(tmp_path / 'cache'))
+    key = cache.key(LEAF, ZipPackage(write_package_zip(path, b'p {}', 1000000000)))
+    assert cache.key(LEAF, ZipPackage(path)) == key
+
+    write_package_zip(path, b'a {}', 1000000100)
+    assert cache.key(LEAF, ZipPackage(path)) != key
+
+
+def test_trim_evicts_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache = ZipCache(cache_dir)
+    for i, key in enumerate(['old', 'middle', 'new']):
+        path = cache.put(key, write_zip(str(tmp_path / 'built.zip'), 100))
+        os.utime(path, (1000000000 + i, 1000000000 + i))
+
+    # A new cache object, as in the next run; nothing is pinned.
+    cache = ZipCache(cache_dir, max_size=250)
+    assert cache.get('old') is not None
+    assert cache.trim() == 1
+    assert sorted(key for key, _, _ in cache.entries()) == ['new', 'old']
+
+
+def test_pinned_zips_are_not_evicted(tmp_path):
+    ZipCache(str(tmp_path / 'cache')).put('a', write_zip(str(tmp_path / 'a.zip'), 100))
+    cache = ZipCache(str(tmp_path / 'cache'), max_size=0)
+    cache.pin(cache.path('a'))
+    assert cache.trim() == 0
+    assert cache.get('a') is not None
+
+    cache.release()
+    assert cache.trim() == 1
+    assert cache.get('a') is None
+
+
+def test_make_topic_tree_leaves_no_copies(tmp_path, examples_dir):
+    package = ZipPackage(str(examples_dir / 'eventos.zip'), str(tmp_path / 'extracted'))
+    organization = extract_from_dir(package, None)['organizations'][0]
+    cache = ZipCache(str(tmp_path / 'cache'))
+    for run in range(2):
+        temp_dir = tmp_path / ('temp%d' % run)
+        temp_dir.mkdir()
+        stats = PipelineStats()
+        make_topic_tree(None, organization, package, temp_dir=str(temp_dir), cache=cache,
+                stats=stats)
+        assert list(temp_dir.iterdir()) == []
+    counters = stats.report()['counters']
+    assert counters['cache_hits'] == len(cache.entries())
+    assert 'cache_misses' not in counters
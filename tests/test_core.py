@@ -0,0 +1,70 @@
+import os
+import zipfile
+
+import pytest
+
+from imscp.cache import ParseCache
+from imscp.core import extract_from_dir, extract_from_zip, iter_items, parse_manifest
+from imscp.stats import PipelineStats
+
+
+def deep_manifest(depth):
+    """Return a manifest whose only leaf is nested depth items deep."""
+    return ''.join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1" identifier="M">',
+        '<organizations><organization identifier="O"><title>Org</title>',
+        ''.join('<item identifier="I%d"><title>T%d</title>' % (i, i) for i in range(depth)),
+        '<item identifier="LEAF" identifierref="R"><title>Leaf</title></item>',
+        '</item>' * depth,
+        '</organization></organizations>',
+        '<resources><resource identifier="R" type="webcontent" href="a.html">',
+        '<file href="a.html"/></resource></resources></manifest>',
+    ])
+
+
+def test_deep_manifest(tmp_path):
+    # Deeper than libxml2's default limit of 256 nested elements.
+    depth = 300
+    (tmp_path / 'imsmanifest.xml').write_text(deep_manifest(depth))
+
+    root, strategy = parse_manifest(str(tmp_path))
+    assert strategy == 'declared'
+
+    item = extract_from_dir(str(tmp_path), None)['organizations'][0]
+    levels = 0
+    while item.get('children'):
+        item = item['children'][0]
+        levels += 1
+    assert levels == depth + 1
+    assert item['item_identifier'] == 'LEAF'
+    assert item['files'] == ['./a.html']
+
+    streamed = list(iter_items(str(tmp_path)))
+    assert len(streamed) == depth + 2
+    assert len(streamed[-1].path) == depth + 1
+    assert streamed[-1].is_leaf
+
+
+def test_extract_from_zip_with_parse_cache(tmp_path, package_zip):
+    parse_cache = ParseCache(str(tmp_path / 'cache'))
+    parsed = extract_from_zip(package_zip, None, str(tmp_path / 'first'), parse_cache=parse_cache)
+
+    stats = PipelineStats()
+    cached = extract_from_zip(package_zip, None, str(tmp_path / 'second'), stats=stats,
+            parse_cache=parse_cache)
+    assert cached == parsed
+    counters = stats.report()['counters']
+    assert counters['parse_cache_hits'] == 1
+    # The files the result refers to are still extracted.
+    assert counters['files_extracted'] == 7
+    assert os.path.isfile(str(tmp_path / 'second' / 'book' / 'book.css'))
+
+
+def test_extract_from_zip_reads_manifest_before_extracting(tmp_path):
+    zip_path = str(tmp_path / 'broken.zip')
+    with zipfile.ZipFile(zip_path, 'w') as zip_file:
+        zip_file.writestr('page.html', b'<html></html>')
+    with pytest.raises(FileNotFoundError):
+        extract_from_zip(zip_path, None, str(tmp_path / 'extracted'))
+    assert not os.path.exists(str(tmp_path / 'extracted' / 'page.html'))
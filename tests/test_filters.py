@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from imscp.core import extract_from_dir, extract_from_zip
+from imscp.filters import ItemFilter, filter_tree
+from imscp.package import ZipPackage
+from imscp.ricecooker_utils import make_topic_tree
+
+
+def outline(item):
+    """Return the titles of a tree as nested (title, [children]) tuples."""
+    if not item.get('children'):
+        return item['title']
+    return (item['title'], [outline(child) for child in item['children']])
+
+
+@pytest.fixture
+def organization(package_zip):
+    return extract_from_dir(ZipPackage(package_zip), None)['organizations'][0]
+
+
+@pytest.mark.parametrize('item_filter, expected', [
+    (ItemFilter(identifiers=['CH1']), ('Org', [('Topic', ['Chapter 1'])])),
+    # Leaves also match by their resource.
+    (ItemFilter(identifiers=['BOOK2', 'QUIZ']), ('Org', [('Topic', ['Chapter 2']), 'Quiz'])),
+    # A selected topic keeps its whole subtree.
+    (ItemFilter(predicate=lambda path: path[-1] == 'Topic'),
+        ('Org', [('Topic', ['Chapter 1', 'Chapter 2'])])),
+    # Everything but one chapter.
+    (ItemFilter(predicate=lambda path: len(path) > 1 and path[-1] not in ('Topic', 'Chapter 2')),
+        ('Org', [('Topic', ['Chapter 1']), 'Page', 'Quiz'])),
+    # Without identifiers or a predicate, everything is kept.
+    (ItemFilter(organizations=['O']),
+        ('Org', [('Topic', ['Chapter 1', 'Chapter 2']), 'Page', 'Quiz'])),
+])
+def test_filter_tree(package_zip, organization, item_filter, expected):
+    assert outline(filter_tree(organization, item_filter)) == expected
+    # Filtering while the manifest is walked gives the same tree.
+    filtered = extract_from_dir(ZipPackage(package_zip), None,
+            item_filter=item_filter)['organizations']
+    assert [outline(org) for org in filtered] == [expected]
+
+
+def test_topic_left_empty_is_dropped(organization):
+    # Nothing under Topic is selected, so it goes too.
+    assert outline(filter_tree(organization, ItemFilter(identifiers=['P', 'Q']))) == (
+            'Org', ['Page', 'Quiz'])
+
+
+def test_nothing_selected(tmp_path, package_zip, organization):
+    item_filter = ItemFilter(identifiers=['NOPE'])
+    assert filter_tree(organization, item_filter) is None
+    assert extract_from_dir(ZipPackage(package_zip), None,
+            item_filter=item_filter)['organizations'] == []
+    assert extract_from_dir(ZipPackage(package_zip), None,
+            item_filter=ItemFilter(organizations=['OTHER']))['organizations'] == []
+    assert make_topic_tree(None, organization, ZipPackage(package_zip),
+            temp_dir=str(tmp_path), item_filter=item_filter) is None
+
+
+def test_filter_tree_keeps_selected_items(organization):
+    topic = organization['children'][0]
+    filtered = filter_tree(organization, ItemFilter(identifiers=['CH2']))
+    # Selected items are returned as they are, and topics above them are
+    # copied instead of changed.
+    assert filtered['children'][0]['children'][0] is topic['children'][1]
+    assert len(topic['children']) == 2
+    assert len(organization['children']) == 3
+
+
+def test_extract_from_zip_extracts_selected_files(tmp_path, package_zip):
+    extract_path = tmp_path / 'extracted'
+    extract_from_zip(package_zip, None, str(extract_path),
+            item_filter=ItemFilter(identifiers=['PAGE']))
+    extracted = sorted(os.path.relpath(os.path.join(root, name), str(extract_path))
+            for root, _, names in os.walk(str(extract_path)) for name in names)
+    assert extracted == ['imsmanifest.xml', os.path.join('media', 'image.png'), 'page.html']
@@ -0,0 +1,154 @@
+import json
+import os
+
+import pytest
+
+import imscp
+from imscp.core import extract_from_dir
+from imscp.incremental import IncrementalState
+from imscp.ricecooker_utils import make_topic_tree
+from imscp.stats import PipelineStats
+from packages import FILES, MANIFEST
+
+
+KEYS = ['O', 'O/T', 'O/T/CH1', 'O/T/CH2', 'O/P', 'O/Q']
+
+
+@pytest.fixture
+def package_dir(tmp_path):
+    files = dict(FILES, **{'imsmanifest.xml': MANIFEST.encode('utf-8')})
+    for name, content in files.items():
+        path = tmp_path / 'package' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return str(tmp_path / 'package')
+
+
+def organization(package_dir):
+    return extract_from_dir(package_dir, None)['organizations'][0]
+
+
+def statuses(planned):
+    return dict((planned_item.key, planned_item.status) for planned_item in planned)
+
+
+def run(state_path, package_dir, options=''):
+    """Plan and record a run as make_topic_tree does, and save the state."""
+    state = IncrementalState(state_path)
+    planned = state.plan(organization(package_dir), package_dir, options=options)
+    state.record(planned, {}, dict((id(p.item), p.key.upper()) for p in planned))
+    state.save()
+    return planned
+
+
+def test_plan_of_first_run(tmp_path, package_dir):
+    state = IncrementalState(str(tmp_path / 'state.json'))
+    planned = state.plan(organization(package_dir), package_dir)
+    assert [planned_item.key for planned_item in planned] == KEYS
+    assert set(statuses(planned).values()) == {'added'}
+    assert [state.reusable(planned_item) for planned_item in planned] == [None] * len(KEYS)
+
+
+def test_unchanged_items_are_reusable(tmp_path, package_dir):
+    state_path = str(tmp_path / 'state.json')
+    run(state_path, package_dir)
+
+    state = IncrementalState(state_path)
+    planned = state.plan(organization(package_dir), package_dir)
+    assert set(statuses(planned).values()) == {'unchanged'}
+    assert [state.reusable(planned_item)['source_id'] for planned_item in planned] == [
+            key.upper() for key in KEYS]
+
+
+def test_changed_files_change_only_their_leaves(tmp_path, package_dir):
+    state_path = str(tmp_path / 'state.json')
+    run(state_path, package_dir)
+    with open(os.path.join(package_dir, 'book', 'book.css'), 'ab') as f:
+        f.write(b'p {}\n')
+
+    state = IncrementalState(state_path)
+    planned = state.plan(organization(package_dir), package_dir)
+    # Topics are fingerprinted without their children.
+    assert statuses(planned) == {'O': 'unchanged', 'O/T': 'unchanged', 'O/T/CH1': 'changed',
+            'O/T/CH2': 'changed', 'O/P': 'unchanged', 'O/Q': 'unchanged'}
+    assert state.reusable(planned[2]) is None
+    assert state.reusable(planned[4]) is not None
+
+
+def test_changed_options_change_every_leaf(tmp_path, package_dir):
+    state_path = str(tmp_path / 'state.json')
+    run(state_path, package_dir)
+
+    planned = IncrementalState(state_path).plan(organization(package_dir), package_dir,
+            options='scraper')
+    assert statuses(planned) == {'O': 'unchanged', 'O/T': 'unchanged', 'O/T/CH1': 'changed',
+            'O/T/CH2': 'changed', 'O/P': 'changed', 'O/Q': 'changed'}
+
+
+def test_record_counts_and_removed_items(tmp_path, package_dir):
+    state_path = str(tmp_path / 'state.json')
+    run(state_path, package_dir)
+    with open(os.path.join(package_dir, 'page.html'), 'ab') as f:
+        f.write(b'<!-- edited -->')
+
+    state = IncrementalState(state_path)
+    imscp_dict = organization(package_dir)
+    topic = imscp_dict['children'][0]
+    topic['children'].pop()
+    planned = state.plan(imscp_dict, package_dir)
+    state.record(planned, {id(topic['children'][0]): 'ch1.zip'}, {})
+    # Recording the same items again, as for a second organization
+    # sharing them, doesn't count them twice.
+    state.record(planned, {}, {})
+    assert state.removed() == ['O/T/CH2']
+    assert list(state.report().items()) == [('added', 0), ('changed', 1), ('unchanged', 4),
+            ('removed', 1)]
+
+    state.save()
+    with open(state_path) as f:
+        saved = json.load(f)
+    assert saved['version'] == imscp.__version__
+    assert list(saved['items']) == ['O', 'O/T', 'O/T/CH1', 'O/P', 'O/Q']
+    assert 'zip_path' not in saved['items']['O/P']
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.part')]
+
+
+def test_state_of_other_version_is_ignored(tmp_path, package_dir):
+    state_path = str(tmp_path / 'state.json')
+    run(state_path, package_dir)
+    with open(state_path) as f:
+        saved = json.load(f)
+    saved['version'] = '0.0.0'
+    with open(state_path, 'w') as f:
+        json.dump(saved, f)
+
+    planned = IncrementalState(state_path).plan(organization(package_dir), package_dir)
+    assert set(statuses(planned).values()) == {'added'}
+
+
+def test_make_topic_tree_reuses_zips(tmp_path, package_dir):
+    state_path = str(tmp_path / 'state.json')
+    temp_dir = tmp_path / 'temp'
+    temp_dir.mkdir()
+
+    def convert():
+        state = IncrementalState(state_path)
+        stats = PipelineStats()
+        tree = make_topic_tree(None, organization(package_dir), package_dir,
+                temp_dir=str(temp_dir), incremental=state, stats=stats)
+        state.save()
+        return tree, stats.report()['counters']
+
+    tree, counters = convert()
+    assert counters['items_added'] == len(KEYS)
+    zips = sorted(os.listdir(str(temp_dir)))
+
+    with open(os.path.join(package_dir, 'quiz', 'quiz.js'), 'ab') as f:
+        f.write(b'answers.push(4);\n')
+    second_tree, counters = convert()
+    assert (counters['items_unchanged'], counters['items_changed']) == (len(KEYS) - 1, 1)
+    # Only the quiz was rebuilt, and topics kept their source ids.
+    assert len(set(os.listdir(str(temp_dir))) - set(zips)) == 1
+    assert second_tree.children[0].source_id == tree.children[0].source_id
+    assert second_tree.children[1].files[0].path == tree.children[1].files[0].path
+    assert second_tree.children[2].files[0].path != tree.children[2].files[0].path
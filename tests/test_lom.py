@@ -0,0 +1,84 @@
+import pytest
+from lxml import etree
+
+from imscp.core import LOM_SECTIONS, collect_metadata, parse_manifest, strip_langstring, strip_ns_prefix
+from imscp.package import ZipPackage
+
+xmltodict = pytest.importorskip('xmltodict')
+
+
+METADATA = b'''<?xml version="1.0" encoding="UTF-8"?>
+<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1"
+    xmlns:imsmd="http://www.imsglobal.org/xsd/imsmd_v1p2"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" identifier="M">
+  <metadata>
+    <imsmd:lom>
+      <imsmd:general>
+        <imsmd:identifier>ID-1</imsmd:identifier>
+        <imsmd:title>
+          <imsmd:langstring xml:lang="es">Un t\xc3\xadtulo</imsmd:langstring>
+        </imsmd:title>
+        <!-- A comment between keywords -->
+        <imsmd:keyword><imsmd:langstring xml:lang="es">uno</imsmd:langstring></imsmd:keyword>
+        <imsmd:keyword><imsmd:langstring xml:lang="es">dos</imsmd:langstring></imsmd:keyword>
+        <imsmd:language>es</imsmd:language>
+        <imsmd:description>Before <imsmd:langstring>inside</imsmd:langstring> after</imsmd:description>
+        <imsmd:coverage xsi:type="place" scope="local"/>
+      </imsmd:general>
+      <imsmd:lifecycle>
+        <imsmd:contribute>
+          <imsmd:role><imsmd:source>LOMv1.0</imsmd:source><imsmd:value>author</imsmd:value></imsmd:role>
+          <imsmd:centity><imsmd:vcard>BEGIN:VCARD FN:Ana END:VCARD</imsmd:vcard></imsmd:centity>
+        </imsmd:contribute>
+        <imsmd:contribute>
+          <imsmd:role><imsmd:value>publisher</imsmd:value></imsmd:role>
+        </imsmd:contribute>
+      </imsmd:lifecycle>
+      <imsmd:educational>
+        <imsmd:interactivitytype xmlns:ex="http://example.com/ex">
+          <imsmd:source ex:note="n">LOMv1.0</imsmd:source>
+          <imsmd:value>active</imsmd:value>
+        </imsmd:interactivitytype>
+      </imsmd:educational>
+      <imsmd:rights>
+        <imsmd:langstring>Only a langstring</imsmd:langstring>
+      </imsmd:rights>
+    </imsmd:lom>
+  </metadata>
+  <organizations/>
+  <resources/>
+</manifest>
+'''
+
+
+def xmltodict_metadata(metadata_elem):
+    """collect_metadata as it was before it walked the elements itself."""
+    strip_ns_prefix(metadata_elem)
+    strip_langstring(metadata_elem)
+    metadata_dict = {}
+    for tag in LOM_SECTIONS:
+        elem = metadata_elem.find('lom/%s' % tag)
+        if elem is not None and len(elem):
+            metadata_dict.update(xmltodict.parse(etree.tostring(elem)))
+    return metadata_dict
+
+
+def metadata_elements(root):
+    return root.xpath('//*[local-name()="metadata"]')
+
+
+def test_lom_matches_xmltodict():
+    # The old conversion strips the tree in place, so each side gets its own.
+    metadata = collect_metadata(metadata_elements(etree.fromstring(METADATA))[0])
+    assert metadata == xmltodict_metadata(metadata_elements(etree.fromstring(METADATA))[0])
+    assert metadata['general']['keyword'] == ['uno', 'dos']
+    assert 'rights' not in metadata
+
+
+@pytest.mark.parametrize('name', ['gitta_ims.zip', 'test_quiz.zip'])
+def test_example_lom_matches_xmltodict(examples_dir, name):
+    package = ZipPackage(str(examples_dir / name))
+    converted = [collect_metadata(elem) for elem in metadata_elements(parse_manifest(package)[0])]
+    expected = [xmltodict_metadata(elem) for elem in metadata_elements(parse_manifest(package)[0])]
+    assert any(converted)
+    assert converted == expected
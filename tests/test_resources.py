@@ -0,0 +1,55 @@
+from imscp.core import ResourceGraph
+
+
+def graph(dependencies):
+    """Return a ResourceGraph of resources with one file each, named after them."""
+    return ResourceGraph(dict((identifier, {
+        'attributes': {'identifier': identifier},
+        'files': ('./%s.html' % identifier,),
+        'dependencies': tuple(deps),
+    }) for identifier, deps in dependencies.items()))
+
+
+def test_two_resource_cycle():
+    resources = graph({'A': ['B'], 'B': ['A']})
+    assert resources.files('A') == ['./A.html', './B.html']
+    assert resources.files('B') == ['./B.html', './A.html']
+    assert [sorted(cycle) for cycle in resources.cycles] == [['A', 'B']]
+
+
+def test_self_dependency():
+    resources = graph({'A': ['A', 'B'], 'B': []})
+    assert resources.files('A') == ['./A.html', './B.html']
+    assert [sorted(cycle) for cycle in resources.cycles] == [['A']]
+
+
+def test_resources_depending_on_a_cycle():
+    resources = graph({'C': ['D', 'A'], 'D': ['A'], 'A': ['B'], 'B': ['A', 'E'], 'E': []})
+    assert resources.files('C') == ['./C.html', './D.html', './A.html', './B.html', './E.html']
+    assert resources.files('E') == ['./E.html']
+    # The cycle is resolved once, however many resources lead to it.
+    assert len(resources.cycles) == 1
+    assert resources.resolved == 5
+
+
+def test_long_chain_into_cycle():
+    # Deeper than the recursion limit.
+    size = 5000
+    dependencies = dict(('R%d' % i, ['R%d' % (i + 1)]) for i in range(size - 1))
+    dependencies['R%d' % (size - 1)] = ['R%d' % (size - 2)]
+    resources = graph(dependencies)
+    files = resources.files('R0')
+    assert files == ['./R%d.html' % i for i in range(size)]
+    assert resources.files('R%d' % (size - 1)) == ['./R%d.html' % (size - 1), './R%d.html' % (size - 2)]
+    assert [sorted(cycle) for cycle in resources.cycles] == [['R%d' % (size - 2), 'R%d' % (size - 1)]]
+
+
+def test_missing_dependency():
+    resources = graph({'A': ['B', 'MISSING'], 'B': ['A']})
+    assert resources.files('A') == ['./A.html', './B.html']
+
+
+def test_files_are_copies():
+    resources = graph({'A': ['B'], 'B': ['A']})
+    resources.files('A').append('./other.html')
+    assert resources.files('A') == ['./A.html', './B.html']
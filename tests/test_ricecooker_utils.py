@@ -0,0 +1,51 @@
+import os
+import zipfile
+
+import pytest
+
+from imscp.core import extract_from_dir
+from imscp.package import ZipPackage
+from imscp.ricecooker_utils import make_topic_tree
+from packages import FILES, PageScraper
+
+
+def tree_contents(node):
+    """Return the titles, source ids and zip contents of a topic tree."""
+    if node.children:
+        return (node.title, [tree_contents(child) for child in node.children])
+    with zipfile.ZipFile(node.files[0].path) as zip_file:
+        contents = dict((name, zip_file.read(name)) for name in zip_file.namelist())
+    return (node.title, node.source_id, contents)
+
+
+def build(package_zip, temp_dir, **kwargs):
+    os.makedirs(temp_dir)
+    package = ZipPackage(package_zip, os.path.join(temp_dir, 'extracted'))
+    organization = extract_from_dir(package, None)['organizations'][0]
+    return tree_contents(make_topic_tree(None, organization, package, temp_dir=temp_dir, **kwargs))
+
+
+@pytest.mark.parametrize('scraper_class', [None, PageScraper])
+@pytest.mark.parametrize('use_threads', [True, False])
+def test_parallel_build_matches_serial(tmp_path, package_zip, scraper_class, use_threads):
+    serial = build(package_zip, str(tmp_path / 'serial'), scraper_class=scraper_class)
+    parallel = build(package_zip, str(tmp_path / 'parallel'), scraper_class=scraper_class,
+            jobs=3, use_threads=use_threads)
+    assert parallel == serial
+    chapters = serial[1][0][1]
+    assert [chapter[1] for chapter in chapters] == ['BOOK1', 'BOOK2']
+    assert chapters[0][2]['index.html'] == FILES['book/index.html']
+
+
+def test_parallel_scrape_extracts_once(tmp_path, package_zip, monkeypatch):
+    calls = []
+    extractall = zipfile.ZipFile.extractall
+
+    def counting_extractall(self, *args, **kwargs):
+        calls.append(self.filename)
+        return extractall(self, *args, **kwargs)
+    monkeypatch.setattr(zipfile.ZipFile, 'extractall', counting_extractall)
+
+    build(package_zip, str(tmp_path / 'parallel'), scraper_class=PageScraper, jobs=3,
+            use_threads=True)
+    assert calls == [package_zip]
@@ -0,0 +1,31 @@
+from imscp.scorm import inject_scorm_scripts, scorm_script_srcs
+
+
+SCRIPTS = b''.join(b'<script src="%s"></script>' % src.encode('utf-8') for src in scorm_script_srcs())
+
+
+def test_scripts_at_start_of_head():
+    html = b'<html><head><title>T</title></head><body></body></html>'
+    assert inject_scorm_scripts(html) == b'<html><head>' + SCRIPTS + b'<title>T</title></head><body></body></html>'
+
+
+def test_head_in_comment_is_skipped():
+    html = b'<!-- <head> of the old layout --><html><head lang="en"><title>T</title></head></html>'
+    position = html.index(b'<head lang="en">') + len(b'<head lang="en">')
+    assert inject_scorm_scripts(html) == html[:position] + SCRIPTS + html[position:]
+
+
+def test_only_head_in_comment():
+    html = b'<html><!--<head>--><body></body></html>'
+    assert inject_scorm_scripts(html) == b'<html><head>' + SCRIPTS + b'</head><!--<head>--><body></body></html>'
+
+
+def test_hot_potatoes_ignores_commented_meta():
+    meta = b'<meta name="author" content="Created with Hot Potatoes by Half-Baked Software">'
+    html = b'<html><head><script src="hp.js"></script>%s</head><body></body></html>' % meta
+    position = html.index(b'</head>')
+    assert inject_scorm_scripts(html) == html[:position] + SCRIPTS + html[position:]
+
+    commented = html.replace(meta, b'<!-- ' + meta + b' -->')
+    position = len(b'<html><head>')
+    assert inject_scorm_scripts(commented) == commented[:position] + SCRIPTS + commented[position:]
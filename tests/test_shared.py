@@ -0,0 +1,144 @@
+import zipfile
+
+import pytest
+from le_utils.constants import format_presets
+
+from imscp.core import extract_from_dir
+from imscp.package import DirPackage
+from imscp.ricecooker_utils import make_topic_tree
+from imscp.shared import SharedAssets, rewrite_references
+
+
+BASE = '/zipcontent/deps.zip/'
+SHARED = {'style.css': BASE, 'logo.png': BASE, 'my file.png': BASE, 'app.js': BASE}
+
+
+@pytest.mark.parametrize('before, after', [
+    (b'<link href="style.css">', b'<link href="/zipcontent/deps.zip/style.css">'),
+    (b"<link href='./style.css'>", b"<link href='/zipcontent/deps.zip/style.css'>"),
+    (b'<img src=logo.png>', b'<img src=/zipcontent/deps.zip/logo.png>'),
+    (b'<img SRC = "logo.png">', b'<img SRC = "/zipcontent/deps.zip/logo.png">'),
+    (b'<td background="logo.png">', b'<td background="/zipcontent/deps.zip/logo.png">'),
+    (b'body { background: url( "logo.png" ) }', b'body { background: url( "/zipcontent/deps.zip/logo.png" ) }'),
+    (b"@import 'style.css';", b"@import '/zipcontent/deps.zip/style.css';"),
+    (b'@import url(style.css);', b'@import url(/zipcontent/deps.zip/style.css);'),
+    # Queries and fragments are kept, and names are matched unquoted.
+    (b'<script src="app.js?v=2"></script>', b'<script src="/zipcontent/deps.zip/app.js?v=2"></script>'),
+    (b'<img src="my%20file.png">', b'<img src="/zipcontent/deps.zip/my%20file.png">'),
+])
+def test_rewrites_references(before, after):
+    assert rewrite_references(before, SHARED) == after
+
+
+@pytest.mark.parametrize('data', [
+    # Files that aren't shared, or other files with a shared file's name.
+    b'<script src="app.jsx"></script>',
+    b'<link href="style.css.bak">',
+    b'<img src="img/logo.png">',
+    b'<img src="../logo.png">',
+    b'<img src="http://example.com/logo.png">',
+    b'<img src="">',
+    # Text that only looks like a reference.
+    b'<p>The src of the logo.png</p>',
+    # Already rewritten.
+    b'<img src="/zipcontent/deps.zip/logo.png">',
+])
+def test_leaves_other_data_alone(data):
+    assert rewrite_references(data, SHARED) == data
+
+
+def leaf(*files):
+    return {'index_file': 'index.html', 'files': ['index.html'] + list(files)}
+
+
+@pytest.fixture
+def package(tmp_path):
+    for name in ('index.html', 'a/common.css', 'a/x.js', 'b/x.js', 'a/z.css', 'b/z.css'):
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(name.encode('utf-8'))
+    return DirPackage(str(tmp_path))
+
+
+def test_groups(package):
+    leaves = [
+        leaf('a/common.css', 'a/x.js', 'a/z.css'),
+        leaf('a/common.css', 'b/x.js', 'a/z.css'),
+        leaf('a/common.css', 'b/x.js', 'b/z.css', 'missing.css'),
+        leaf('b/z.css', 'missing.css'),
+        leaf('b/z.css'),
+    ]
+    # Only one file of each name fits in a single zip, the one most shared.
+    [(files, users)] = SharedAssets().groups(leaves, package)
+    assert list(files.items()) == [('common.css', 'a/common.css'), ('x.js', 'b/x.js'),
+            ('z.css', 'b/z.css')]
+    assert users == {'common.css': [0, 1, 2], 'x.js': [1, 2], 'z.css': [2, 3, 4]}
+
+    groups = SharedAssets(grouping='leaves').groups(leaves, package)
+    assert [(list(files.values()), users) for files, users in groups] == [
+        (['a/common.css'], {'common.css': [0, 1, 2]}),
+        (['a/z.css'], {'z.css': [0, 1]}),
+        (['b/x.js'], {'x.js': [1, 2]}),
+        (['b/z.css'], {'z.css': [2, 3, 4]}),
+    ]
+
+    assert SharedAssets(min_leaves=3).groups(leaves, package)[0][1] == {
+        'common.css': [0, 1, 2], 'z.css': [2, 3, 4]}
+
+
+MANIFEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1" identifier="M">
+  <organizations><organization identifier="O"><title>Org</title>
+    <item identifier="I1" identifierref="R1"><title>One</title></item>
+    <item identifier="I2" identifierref="R2"><title>Two</title></item>
+  </organization></organizations>
+  <resources>
+    <resource identifier="R1" type="webcontent" href="one.html">
+      <file href="one.html"/><dependency identifierref="COMMON"/>
+    </resource>
+    <resource identifier="R2" type="webcontent" href="two/two.html">
+      <file href="two/two.html"/><dependency identifierref="COMMON"/>
+    </resource>
+    <resource identifier="COMMON" type="webcontent">
+      <file href="common/style.css"/><file href="common/logo.png"/>
+    </resource>
+  </resources>
+</manifest>
+'''
+
+
+def test_make_topic_tree_moves_shared_files(tmp_path):
+    files = {
+        'imsmanifest.xml': MANIFEST.encode('utf-8'),
+        'one.html': b'<link href="style.css"><img src="logo.png">',
+        'two/two.html': b'<link href="./style.css">',
+        'common/style.css': b'h1 { background: url(logo.png); }',
+        'common/logo.png': b'\x89PNG',
+    }
+    package_dir = tmp_path / 'package'
+    for name, content in files.items():
+        path = package_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    temp_dir = tmp_path / 'temp'
+    temp_dir.mkdir()
+
+    organization = extract_from_dir(str(package_dir), None)['organizations'][0]
+    tree = make_topic_tree(None, organization, str(package_dir), temp_dir=str(temp_dir),
+            shared_assets=SharedAssets())
+    one, two = tree.children
+    dependency = one.files[1].path
+    assert two.files[1].path == dependency
+    assert one.files[1].get_preset() == format_presets.HTML5_DEPENDENCY_ZIP
+    with zipfile.ZipFile(dependency) as zip_file:
+        assert sorted(zip_file.namelist()) == ['logo.png', 'style.css']
+        # Files in the dependency zip refer to each other by name, as before.
+        assert zip_file.read('style.css') == files['common/style.css']
+
+    base = '/zipcontent/%s/' % dependency.rsplit('/', 1)[1]
+    with zipfile.ZipFile(one.files[0].path) as zip_file:
+        assert sorted(zip_file.namelist()) == ['index.html', 'one.html']
+        assert zip_file.read('index.html') == (
+                '<link href="%sstyle.css"><img src="%slogo.png">' % (base, base)).encode('utf-8')
+    with zipfile.ZipFile(two.files[0].path) as zip_file:
+        assert zip_file.read('index.html') == ('<link href="%sstyle.css">' % base).encode('utf-8')
@@ -0,0 +1,145 @@
+import asyncio
+import gc
+import logging
+import os
+import threading
+import zipfile
+
+import pytest
+
+from imscp.core import extract_from_dir
+from imscp.package import ZipPackage
+from imscp.ricecooker_utils import make_topic_tree
+from imscp.stats import PipelineStats
+from imscp.streaming import stream_nodes
+from packages import PageScraper
+
+
+def tree_contents(node):
+    """Return the titles and zip contents of a topic tree (topic ids are random)."""
+    if node.children:
+        return (node.title, [tree_contents(child) for child in node.children])
+    with zipfile.ZipFile(node.files[0].path) as zip_file:
+        contents = dict((name, zip_file.read(name)) for name in zip_file.namelist())
+    return (node.title, node.source_id, contents)
+
+
+def zips_in(directory):
+    return len([name for name in os.listdir(directory) if name.endswith('.zip')])
+
+
+@pytest.fixture
+def package(tmp_path, examples_dir):
+    return ZipPackage(str(examples_dir / 'gitta_ims.zip'), str(tmp_path / 'extracted'))
+
+
+@pytest.mark.parametrize('use_threads', [True, False])
+def test_stream_matches_make_topic_tree(tmp_path, package, use_threads):
+    (tmp_path / 'tree').mkdir()
+    (tmp_path / 'stream').mkdir()
+    expected = [tree_contents(make_topic_tree(None, organization, package, temp_dir=str(tmp_path / 'tree')))
+            for organization in extract_from_dir(package, None)['organizations']]
+
+    async def stream():
+        return [streamed async for streamed in stream_nodes(None, package,
+                temp_dir=str(tmp_path / 'stream'), jobs=2, use_threads=use_threads)]
+    streamed = asyncio.run(stream())
+    assert [tree_contents(s.node) for s in streamed if not s.path] == expected
+    # Topics come before their children.
+    paths = [s.path + (s.item['identifier'],) for s in streamed]
+    assert all(path[:-1] in paths or not path[:-1] for path in paths)
+
+
+def test_max_pending_limits_zips_built_ahead(tmp_path, package):
+    max_pending = 2
+
+    async def stream():
+        handled = 0
+        async for streamed in stream_nodes(None, package, temp_dir=str(tmp_path), jobs=4,
+                use_threads=True, max_pending=max_pending):
+            if not streamed.node.children and streamed.item.get('type') == 'webcontent':
+                handled += 1
+                # Give the workers time to run ahead as far as they may.
+                await asyncio.sleep(0.05)
+                # One zip waiting to be queued, up to max_pending queued, and
+                # the one being handled.
+                assert handled <= zips_in(str(tmp_path)) <= handled + max_pending + 1
+        return handled
+    assert asyncio.run(stream()) > max_pending + 1
+
+
+def test_max_pending_bytes_limits_zips_built_ahead(tmp_path, package):
+    # Smaller than any app, so only one is built at a time.
+    async def stream():
+        handled = 0
+        async for streamed in stream_nodes(None, package, temp_dir=str(tmp_path), jobs=4,
+                use_threads=True, max_pending_bytes=1):
+            if not streamed.node.children and streamed.item.get('type') == 'webcontent':
+                handled += 1
+                await asyncio.sleep(0.05)
+                assert zips_in(str(tmp_path)) == handled
+        return handled
+    assert asyncio.run(stream()) > 1
+
+
+@pytest.mark.parametrize('use_threads', [True, False])
+def test_early_close(tmp_path, package, caplog, use_threads):
+    async def stream():
+        nodes = stream_nodes(None, package, temp_dir=str(tmp_path), jobs=2,
+                use_threads=use_threads, max_pending=4)
+        count = 0
+        async for _ in nodes:
+            count += 1
+            if count == 3:
+                break
+        await nodes.aclose()
+        return count
+
+    with caplog.at_level(logging.ERROR, logger='asyncio'):
+        assert asyncio.run(stream()) == 3
+        gc.collect()
+    assert [record.getMessage() for record in caplog.records if record.name == 'asyncio'] == []
+    assert threading.active_count() == 1
+
+
+def test_failed_build_leaves_nothing_unretrieved(tmp_path, examples_dir, caplog):
+    with zipfile.ZipFile(str(examples_dir / 'gitta_ims.zip')) as zip_file:
+        zip_file.extractall(str(tmp_path))
+    for root, _, files in os.walk(str(tmp_path)):
+        for name in files:
+            if name.endswith('.html'):
+                os.remove(os.path.join(root, name))
+
+    async def stream():
+        async for _ in stream_nodes(None, str(tmp_path), temp_dir=str(tmp_path), jobs=4,
+                use_threads=True, max_pending=8):
+            await asyncio.sleep(0.05)
+
+    with caplog.at_level(logging.ERROR, logger='asyncio'):
+        with pytest.raises(FileNotFoundError):
+            asyncio.run(stream())
+        gc.collect()
+    assert [record.getMessage() for record in caplog.records if record.name == 'asyncio'] == []
+
+
+def test_scraped_pages_built_once(tmp_path, package_zip, monkeypatch):
+    # Two leaves of package_zip share book/index.html.
+    calls = []
+    extractall = zipfile.ZipFile.extractall
+
+    def counting_extractall(self, *args, **kwargs):
+        calls.append(self.filename)
+        return extractall(self, *args, **kwargs)
+    monkeypatch.setattr(zipfile.ZipFile, 'extractall', counting_extractall)
+
+    package = ZipPackage(package_zip, str(tmp_path / 'extracted'))
+    stats = PipelineStats()
+
+    async def stream():
+        return [streamed async for streamed in stream_nodes(None, package,
+                scraper_class=PageScraper, temp_dir=str(tmp_path), jobs=3,
+                use_threads=True, stats=stats)]
+    leaves = [s for s in asyncio.run(stream()) if not s.node.children]
+    assert calls == [package_zip]
+    assert stats.report()['counters']['zips_built'] == 3
+    assert leaves[0].node.files[0].path == leaves[1].node.files[0].path